@@ -0,0 +1,69 @@
+import asyncio
+from aiohttp import web
+from benchmark.latency import Latency
+
+# Local stand-in for the ElevenLabs text-to-speech API. Audio is filler bytes
+# sized like real speech in the requested output_format (about
+# CHARS_PER_SECOND of text per second of audio).
+CHARS_PER_SECOND = 15
+DEFAULT_KBPS = 128
+CHUNK_SIZE = 4096
+
+def bytes_per_char(output_format: str) -> int:
+    # mp3_22050_32 -> 32 kbps; ulaw_8000 -> 8000 one-byte samples per second
+    parts = (output_format or "").split("_")
+    if parts[0] == "mp3" and len(parts) == 3:
+        kbps = int(parts[2])
+    elif parts[0] in ("ulaw", "alaw") and len(parts) == 2:
+        kbps = int(parts[1]) * 8 // 1000
+    else:
+        kbps = DEFAULT_KBPS
+    return kbps * 1000 // 8 // CHARS_PER_SECOND
+
+class FakeElevenLabs:
+    def __init__(self, first_byte: Latency, bytes_per_second: int = 200_000):
+        self.first_byte = first_byte
+        self.bytes_per_second = bytes_per_second
+        self.stats = {"requests": 0, "stream_requests": 0, "abandoned": 0, "bytes": 0}
+        self._runner = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/text-to-speech/{voice_id}", self.synthesize)
+        app.router.add_post("/v1/text-to-speech/{voice_id}/stream", self.synthesize)
+        return app
+
+    async def synthesize(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        streaming = request.path.endswith("/stream")
+        self.stats["stream_requests" if streaming else "requests"] += 1
+        size = max(CHUNK_SIZE, len(body.get("text", "")) * bytes_per_char(request.query.get("output_format")))
+
+        await asyncio.sleep(self.first_byte.sample())
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        sent = 0
+        try:
+            await response.prepare(request)
+            while sent < size:
+                chunk = min(CHUNK_SIZE, size - sent)
+                await response.write(b"\xff" * chunk)
+                sent += chunk
+                # Synthesis runs faster than real time but is not instant
+                await asyncio.sleep(chunk / self.bytes_per_second)
+            await response.write_eof()
+        except ConnectionResetError:
+            # Client gave up, e.g. the losing side of a hedged request
+            self.stats["abandoned"] += 1
+        self.stats["bytes"] += sent
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,114 @@
+import json
+import random
+import asyncio
+import grpc
+from typing import List
+from google.ai import generativelanguage_v1beta as glm
+from benchmark.latency import Latency
+
+# Local stand-in for the Gemini API. google-generativeai's async client only
+# speaks gRPC over TLS, so this is a grpc.aio server with a self-signed
+# certificate; the app trusts it via GRPC_DEFAULT_SSL_ROOTS_FILE_PATH.
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+STREAM_CHUNK_CHARS = 24
+
+# (keywords, function name, args) checked in order; anything else gets a text reply
+FUNCTION_CALLS = [
+    (("broken", "not working", "leak"), "create_maintenance_ticket", {"issue_type": "Engineering", "description": "Reported by phone"}),
+    (("bill", "balance"), "check_bill", {}),
+    (("order", "burger", "bring me"), "book_room_service", {"item": "Cheeseburger", "quantity": 1}),
+    (("manager", "human"), "transfer_call", {}),
+]
+
+# The opening repeats across calls (cacheable); the rest varies like real replies
+REPLY = (
+    "Of course, I'd be delighted to help with that. Our team will take care of it within {minutes} minutes, "
+    "and please don't hesitate to call if there is anything else you need during your stay."
+)
+
+class FakeGemini:
+    def __init__(self, latency: Latency, chunk_latency: Latency = None, capacity: int = 0):
+        self.latency = latency
+        self.chunk_latency = chunk_latency or Latency("fixed:30")
+        # Past `capacity` concurrent requests every request slows down in
+        # proportion, like a shared backend (0 = unlimited)
+        self.capacity = capacity
+        self.active = 0
+        self.stats = {"requests": 0, "stream_requests": 0, "function_calls": 0, "max_active": 0}
+        self._server = None
+
+    def _slowdown(self) -> float:
+        self.stats["max_active"] = max(self.stats["max_active"], self.active)
+        if not self.capacity:
+            return 1.0
+        return max(1.0, self.active / self.capacity)
+
+    def _reply(self, request) -> glm.Candidate:
+        user_text = ""
+        if request.contents:
+            user_text = " ".join(p.text for p in request.contents[-1].parts).lower()
+        for keywords, name, args in FUNCTION_CALLS:
+            if any(k in user_text for k in keywords):
+                self.stats["function_calls"] += 1
+                part = glm.Part(function_call=glm.FunctionCall(name=name, args=args))
+                break
+        else:
+            part = glm.Part(text=json.dumps({"text": REPLY.format(minutes=random.randint(5, 90)), "language_code": "en", "transfer": False}))
+        return glm.Candidate(content=glm.Content(role="model", parts=[part]), finish_reason=glm.Candidate.FinishReason.STOP)
+
+    async def generate_content(self, request, context):
+        self.stats["requests"] += 1
+        self.active += 1
+        try:
+            candidate = self._reply(request)
+            # Same generation time as the streamed reply, delivered all at once
+            delay = self.latency.sample()
+            part = candidate.content.parts[0]
+            if "function_call" not in part:
+                delay += sum(self.chunk_latency.sample() for _ in _chunks(part.text))
+            await asyncio.sleep(delay * self._slowdown())
+            return glm.GenerateContentResponse(candidates=[candidate])
+        finally:
+            self.active -= 1
+
+    async def stream_generate_content(self, request, context):
+        self.stats["stream_requests"] += 1
+        self.active += 1
+        try:
+            await asyncio.sleep(self.latency.sample() * self._slowdown())
+            candidate = self._reply(request)
+            part = candidate.content.parts[0]
+            if "function_call" in part:
+                yield glm.GenerateContentResponse(candidates=[candidate])
+                return
+            for chunk in _chunks(part.text):
+                yield glm.GenerateContentResponse(candidates=[glm.Candidate(content=glm.Content(role="model", parts=[glm.Part(text=chunk)]))])
+                await asyncio.sleep(self.chunk_latency.sample() * self._slowdown())
+        finally:
+            self.active -= 1
+
+    async def start(self, cert_pem: bytes, key_pem: bytes, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = grpc.aio.server()
+        handler = grpc.method_handlers_generic_handler(SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self.generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize,
+            ),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self.stream_generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize,
+            ),
+        })
+        self._server.add_generic_rpc_handlers((handler,))
+        port = self._server.add_secure_port(f"{host}:{port}", grpc.ssl_server_credentials([(key_pem, cert_pem)]))
+        await self._server.start()
+        return port
+
+    async def stop(self):
+        if self._server:
+            await self._server.stop(grace=None)
+
+def _chunks(text: str) -> List[str]:
+    return [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
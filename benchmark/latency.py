@@ -0,0 +1,45 @@
+import random
+from typing import Dict, List
+
+class Latency:
+    """
+    A latency distribution parsed from a spec string, sampled in seconds:
+
+        fixed:MS                  always MS
+        uniform:LO_MS:HI_MS       uniform between LO and HI
+        normal:MEAN_MS:STDDEV_MS  gaussian, clipped at 0
+        lognormal:MEDIAN_MS:SIGMA long-tailed, like real API latency
+    """
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec: str):
+        kind, *params = spec.split(":")
+        if kind not in self.KINDS or not params:
+            raise ValueError(f"Bad latency spec '{spec}' (expected one of {', '.join(self.KINDS)})")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            ms = p[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            ms = random.gauss(p[0], p[1] if len(p) > 1 else 0)
+        else:
+            ms = random.lognormvariate(0, p[1] if len(p) > 1 else 0.5) * p[0]
+        return max(0.0, ms) / 1000
+
+    def __repr__(self):
+        return self.spec
+
+def percentiles(samples: List[float], points=(50, 95, 99)) -> Dict[str, float]:
+    """
+    Nearest-rank percentiles, keyed "p50" etc. Empty input gives zeros.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": 0.0 for p in points}
+    return {f"p{p}": ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] for p in points}
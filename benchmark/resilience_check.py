@@ -0,0 +1,80 @@
+"""
+Breaker state checks, run without any network:
+
+    python -m benchmark.resilience_check
+
+Exits non-zero if a check fails.
+"""
+import sys
+import asyncio
+from services.resilience import Upstream, CircuitBreaker, CircuitOpenError, UpstreamError
+
+async def _fail():
+    raise RuntimeError("down")
+
+async def _ok():
+    return "ok"
+
+async def _hang():
+    await asyncio.sleep(3600)
+
+async def _open_breaker() -> Upstream:
+    upstream = Upstream("check", deadline_seconds=1.0)
+    upstream.breaker = CircuitBreaker(threshold=1, reset_seconds=0.0)
+    try:
+        await upstream.call(_fail)
+    except UpstreamError:
+        pass
+    assert upstream.breaker.state == "open", upstream.breaker.state
+    return upstream
+
+async def cancelled_trial_releases_breaker():
+    upstream = await _open_breaker()
+    trial = asyncio.create_task(upstream.call(_hang))
+    await asyncio.sleep(0.01)
+    assert upstream.breaker.state == "half_open" and upstream.breaker.trial_in_flight
+    trial.cancel()
+    try:
+        await trial
+    except asyncio.CancelledError:
+        pass
+    assert not upstream.breaker.trial_in_flight, "cancelled trial left in flight"
+    assert upstream.available(), "breaker stuck after a cancelled trial"
+    assert await upstream.call(_ok) == "ok"
+    assert upstream.breaker.state == "closed", upstream.breaker.state
+
+async def second_call_rejected_during_trial():
+    upstream = await _open_breaker()
+    trial = asyncio.create_task(upstream.call(_hang))
+    await asyncio.sleep(0.01)
+    try:
+        await upstream.call(_ok)
+        raise AssertionError("second call let through during a trial")
+    except CircuitOpenError:
+        pass
+    finally:
+        trial.cancel()
+
+async def failed_trial_reopens():
+    upstream = await _open_breaker()
+    try:
+        await upstream.call(_fail)
+    except UpstreamError:
+        pass
+    assert upstream.breaker.state == "open", upstream.breaker.state
+
+CHECKS = [cancelled_trial_releases_breaker, second_call_rejected_during_trial, failed_trial_reopens]
+
+def main() -> int:
+    failed = 0
+    for check in CHECKS:
+        try:
+            asyncio.run(check())
+            print(f"ok    {check.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL  {check.__name__}: {e}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
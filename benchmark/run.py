@@ -0,0 +1,157 @@
+"""
+Offline end-to-end benchmark.
+
+Starts local stand-ins for Gemini and ElevenLabs, runs the app under uvicorn
+in a scratch directory (its own hotel.db, caches and phrases) pointed at
+them, and replays concurrent multi-turn calls through /voice and
+/handle-speech:
+
+    python -m benchmark.run --calls 200 --concurrency 20 --turns 3 \\
+        --llm-latency lognormal:700:0.4 --tts-latency lognormal:250:0.3
+
+Any app setting can be varied through the environment, e.g.
+TTS_STREAMING=true python -m benchmark.run. Pass --url to drive an app that
+is already running instead (it must be pointed at the fakes or real APIs
+by its own configuration).
+"""
+import os
+import sys
+import json
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import aiohttp
+from benchmark.latency import Latency
+from benchmark.fake_gemini import FakeGemini
+from benchmark.fake_elevenlabs import FakeElevenLabs
+from benchmark.twilio_driver import drive, format_report
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _self_signed_cert(workdir: str):
+    cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost"],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+def _scratch_dir(workdir: str) -> str:
+    # The app resolves templates/, data/ and static/ relative to its cwd
+    app_dir = os.path.join(workdir, "app")
+    os.makedirs(app_dir)
+    for name in ("templates", "data"):
+        os.symlink(os.path.join(REPO_DIR, name), os.path.join(app_dir, name))
+    return app_dir
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = asyncio.get_running_loop().time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while asyncio.get_running_loop().time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"App exited with code {process.returncode}")
+            try:
+                async with session.get(f"{url}/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"App did not start within {timeout}s")
+
+async def main(args) -> dict:
+    if args.url:
+        result = await drive(args.url.rstrip("/"), args.calls, args.concurrency, args.turns, args.think_ms / 1000, not args.no_audio)
+        print(format_report(result))
+        return result
+
+    with tempfile.TemporaryDirectory(prefix="hotel-bench-") as workdir:
+        cert, key = _self_signed_cert(workdir)
+        with open(cert, "rb") as f:
+            cert_pem = f.read()
+        with open(key, "rb") as f:
+            key_pem = f.read()
+
+        gemini = FakeGemini(Latency(args.llm_latency), Latency(args.llm_chunk_latency), args.llm_capacity)
+        elevenlabs = FakeElevenLabs(Latency(args.tts_latency), args.tts_bytes_per_second)
+        gemini_port = await gemini.start(cert_pem, key_pem)
+        elevenlabs_port = await elevenlabs.start()
+
+        app_port = _free_port()
+        app_url = f"http://127.0.0.1:{app_port}"
+        env = {
+            **os.environ,
+            "GEMINI_API_KEY": "bench",
+            "GEMINI_API_ENDPOINT": f"127.0.0.1:{gemini_port}",
+            "GRPC_DEFAULT_SSL_ROOTS_FILE_PATH": cert,
+            "ELEVENLABS_API_KEY": "bench",
+            "ELEVENLABS_API_URL": f"http://127.0.0.1:{elevenlabs_port}",
+            "HOST_URL": app_url,
+            "PYTHONWARNINGS": "ignore",
+        }
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO_DIR,
+             "--port", str(app_port), "--log-level", "warning", "--no-access-log"],
+            cwd=_scratch_dir(workdir), env=env,
+        )
+        try:
+            await _wait_ready(app_url, process)
+            # Let the startup phrase top-up finish so it does not skew the first calls
+            await asyncio.sleep(args.warmup_seconds)
+            warmup_stats = dict(elevenlabs.stats)
+
+            print(f"Driving {args.calls} calls x {args.turns} turns, {args.concurrency} concurrent "
+                  f"(LLM {args.llm_latency}, TTS first byte {args.tts_latency})")
+            result = await drive(app_url, args.calls, args.concurrency, args.turns, args.think_ms / 1000, not args.no_audio)
+            result["upstream"] = {
+                "gemini": gemini.stats,
+                "elevenlabs": {k: v - warmup_stats.get(k, 0) for k, v in elevenlabs.stats.items()},
+            }
+            print(format_report(result))
+            print(f"Upstream calls: gemini={gemini.stats}  elevenlabs={result['upstream']['elevenlabs']}")
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            await gemini.stop()
+            await elevenlabs.stop()
+    return result
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for the voice agent.")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3, help="speech turns per call")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between a call's turns")
+    parser.add_argument("--llm-latency", default="lognormal:700:0.4", help="Gemini time to first response")
+    parser.add_argument("--llm-chunk-latency", default="fixed:30", help="gap between streamed Gemini chunks")
+    parser.add_argument("--llm-capacity", type=int, default=0,
+                        help="concurrent Gemini requests before all of them slow down proportionally (0 = unlimited)")
+    parser.add_argument("--tts-latency", default="lognormal:250:0.3", help="ElevenLabs time to first byte")
+    parser.add_argument("--tts-bytes-per-second", type=int, default=200_000)
+    parser.add_argument("--warmup-seconds", type=float, default=5.0)
+    parser.add_argument("--no-audio", action="store_true", help="don't fetch <Play> URLs")
+    parser.add_argument("--url", help="drive an already running app instead of starting one")
+    parser.add_argument("--seed", type=int, default=1, help="seed for call scripts and fake latencies")
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+    result = asyncio.run(main(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,199 @@
+import time
+import random
+import asyncio
+import aiohttp
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+from benchmark.latency import percentiles
+
+# Replays calls the way Twilio does: POST /voice, then one POST
+# /handle-speech per guest utterance, fetching each <Play> URL as the phone
+# would. Scripts mix FAQ turns (fast path), tool calls and plain chat.
+SCRIPTS = [
+    ["What is the wifi password?", "And when does the pool open?", "Thank you, that's all."],
+    ["I'd like to order a cheeseburger please.", "Can you also tell me when checkout is?", "Great, thanks."],
+    ["The air conditioning in my room is broken.", "How long until someone comes?", "Okay, thank you."],
+    ["Can you tell me my bill?", "What time does the gym open?", "Thanks."],
+    ["Do you have any recommendations for dinner nearby?", "Is the spa open tomorrow?", "I'd like to speak to a manager."],
+    ["¿Cuál es la contraseña del wifi?", "¿A qué hora es la salida?", "Gracias."],
+]
+
+# Up to two holds (admission control) plus the filler continuation
+MAX_REDIRECTS = 4
+
+class TurnResult:
+    def __init__(self, call_sid: str, turn: int):
+        self.call_sid = call_sid
+        self.turn = turn
+        self.webhook_s: Optional[float] = None
+        self.first_audio_s: Optional[float] = None  # webhook + first audio byte
+        self.reply_s: Optional[float] = None  # until the TwiML with the actual answer
+        self.fillers = 0
+        self.holds = 0
+        self.status: Optional[int] = None
+        self.played = False
+        self.error: Optional[str] = None
+
+async def _fetch_audio(session: aiohttp.ClientSession, url: str, started: float, result: TurnResult):
+    async with session.get(url) as audio:
+        if audio.status != 200:
+            result.error = f"audio {audio.status}"
+            return
+        first = True
+        async for _ in audio.content.iter_chunked(4096):
+            if first:
+                result.first_audio_s = time.perf_counter() - started
+                first = False
+
+def _gather_action(body: str) -> Optional[str]:
+    gather = ET.fromstring(body).find("Gather")
+    return gather.get("action") if gather is not None else None
+
+async def run_call(session: aiohttp.ClientSession, base_url: str, index: int, turns: int,
+                   think_seconds: float, fetch_audio: bool) -> List[TurnResult]:
+    call_sid = f"CABENCH{index:06d}{random.randrange(16 ** 6):06x}"
+    caller = random.choice(["+15550199", "+15550200", f"+1555{index:07d}"])
+    script = random.choice(SCRIPTS)
+    results = []
+
+    call_started = time.perf_counter()
+    async with session.post(f"{base_url}/voice", data={"CallSid": call_sid, "From": caller}) as response:
+        body = await response.text()
+        if response.status != 200:
+            failed = TurnResult(call_sid, 0)
+            failed.status, failed.error = response.status, "voice webhook failed"
+            return [failed]
+    # Speech goes to the last <Gather>'s action, as Twilio sends it
+    action = _gather_action(body) or "/handle-speech"
+
+    for turn in range(turns):
+        result = TurnResult(call_sid, turn + 1)
+        results.append(result)
+        form = {
+            "CallSid": call_sid,
+            "From": caller,
+            "SpeechResult": script[turn % len(script)],
+            "Confidence": "0.92",
+        }
+        started = time.perf_counter()
+        try:
+            url = f"{base_url}{action}"
+            # Follow <Redirect>s (hold, filler then continuation) the way Twilio does
+            for _ in range(MAX_REDIRECTS + 1):
+                async with session.post(url, data=form) as response:
+                    body = await response.text()
+                    result.status = response.status
+                if result.webhook_s is None:
+                    result.webhook_s = time.perf_counter() - started
+                if result.status != 200:
+                    result.error = f"webhook {result.status}"
+                    break
+
+                twiml = ET.fromstring(body)
+                play = twiml.find("Play")
+                result.played = result.played or play is not None
+                if play is not None and fetch_audio and result.first_audio_s is None:
+                    await _fetch_audio(session, play.text, started, result)
+                redirect = twiml.find("Redirect")
+                if redirect is None:
+                    break
+                if redirect.text.startswith("/retry-speech"):
+                    result.holds += 1
+                else:
+                    result.fillers += 1
+                pause = twiml.find("Pause")
+                if pause is not None:
+                    await asyncio.sleep(float(pause.get("length", 1)))
+                url = f"{base_url}{redirect.text}"
+            result.reply_s = time.perf_counter() - started
+            action = _gather_action(body) or action
+            if "<Dial" in body:
+                break
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        if think_seconds:
+            await asyncio.sleep(think_seconds)
+
+    # Hangup status callback
+    status = {"CallSid": call_sid, "CallStatus": "completed", "CallDuration": str(round(time.perf_counter() - call_started))}
+    async with session.post(f"{base_url}/call-status", data=status) as response:
+        await response.read()
+    return results
+
+async def drive(base_url: str, calls: int, concurrency: int, turns: int,
+                think_seconds: float = 0.0, fetch_audio: bool = True) -> Dict:
+    """
+    Runs `calls` conversations, at most `concurrency` at once, and returns
+    the aggregate report.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency * 2)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def bounded(index: int):
+            async with semaphore:
+                return await run_call(session, base_url, index, turns, think_seconds, fetch_audio)
+
+        started = time.perf_counter()
+        per_call = await asyncio.gather(*(bounded(i) for i in range(calls)))
+        elapsed = time.perf_counter() - started
+
+        try:
+            async with session.get(f"{base_url}/api/stats") as response:
+                server_stats = await response.json()
+            async with session.get(f"{base_url}/api/analytics?hours=1") as response:
+                server_stats["analytics"] = (await response.json())["totals"]
+        except Exception:
+            server_stats = {}
+
+    return report([r for call in per_call for r in call], elapsed, server_stats)
+
+def report(results: List[TurnResult], elapsed: float, server_stats: Dict) -> Dict:
+    ok = [r for r in results if r.error is None]
+    webhook = [r.webhook_s for r in ok if r.webhook_s is not None]
+    first_audio = [r.first_audio_s for r in ok if r.first_audio_s is not None]
+    reply = [r.reply_s for r in ok if r.reply_s is not None]
+    return {
+        "turns": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        # Turns answered with <Say> because no audio could be produced
+        "say_fallbacks": sum(1 for r in ok if not r.played),
+        "filler_turns": sum(1 for r in ok if r.fillers),
+        "held_turns": sum(1 for r in ok if r.holds),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_turns_per_s": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "webhook_ms": {k: round(v * 1000, 1) for k, v in percentiles(webhook).items()},
+        "first_audio_ms": {k: round(v * 1000, 1) for k, v in percentiles(first_audio).items()},
+        "reply_ms": {k: round(v * 1000, 1) for k, v in percentiles(reply).items()},
+        "sample_errors": sorted({r.error for r in results if r.error})[:5],
+        "server_latency_ms": server_stats.get("latency", {}),
+        "server_upstreams": server_stats.get("upstreams", {}),
+        "server_admission": server_stats.get("admission", {}),
+        "server_analytics": server_stats.get("analytics", {}),
+    }
+
+def format_report(result: Dict) -> str:
+    lines = [
+        f"Turns: {result['turns']}  errors: {result['errors']} ({result['error_rate']:.2%})  "
+        f"say fallbacks: {result['say_fallbacks']}  filler turns: {result['filler_turns']}  held turns: {result['held_turns']}",
+        f"Elapsed: {result['elapsed_s']}s  throughput: {result['throughput_turns_per_s']} turns/s",
+        "Webhook latency (ms):     " + "  ".join(f"{k}={v}" for k, v in result["webhook_ms"].items()),
+        "Time to first audio (ms): " + "  ".join(f"{k}={v}" for k, v in result["first_audio_ms"].items()),
+        "Time to answer (ms):      " + "  ".join(f"{k}={v}" for k, v in result["reply_ms"].items()),
+    ]
+    for error in result["sample_errors"]:
+        lines.append(f"  error: {error}")
+    if result["server_latency_ms"]:
+        lines.append("Server stages (ms):")
+        for stage, s in result["server_latency_ms"].items():
+            lines.append(f"  {stage:<32} p50={s['p50_ms']:<8} p95={s['p95_ms']:<8} p99={s['p99_ms']:<8} n={s['count']}")
+    for name, s in result.get("server_upstreams", {}).items():
+        lines.append(f"Upstream {name}: state={s['state']} calls={s['calls']} failures={s['failures']} "
+                     f"timeouts={s['timeouts']} rejected={s['rejected']} hedges={s['hedges']} hedge_wins={s['hedge_wins']}")
+    if result.get("server_analytics"):
+        lines.append("Analytics: " + "  ".join(f"{k}={v}" for k, v in result["server_analytics"].items()))
+    if result.get("server_admission"):
+        lines.append("Admission: " + "  ".join(f"{k}={v}" for k, v in result["server_admission"].items()))
+    return "\n".join(lines)
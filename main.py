@@ -1,37 +1,97 @@
 import os
+import re
 import time
+import uuid
 import asyncio
 import logging
-from fastapi import FastAPI, Form, Response, BackgroundTasks, Request
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode
+from fastapi import FastAPI, Form, Query, Response, BackgroundTasks, Request
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
 from fastapi.templating import Jinja2Templates
 from twilio.twiml.voice_response import VoiceResponse
 from dotenv import load_dotenv
-from services.ai_service import get_ai_response, clear_history
-from services.tts_service import generate_audio
-from services.pms_service import init_db, get_db_connection
-from services.history_service import get_recent_calls
+from services.ai_service import clear_history, needs_llm, FALLBACK_RESPONSE
+from services.tts_service import (
+    generate_audio, get_cache_stats, start_session, close_session,
+    register_stream, get_stream_text, open_audio_stream, phrase_path, wait_for_audio,
+    run_sweeper, audio_media_type, AUDIO_EXT, AUDIO_MEDIA_TYPE,
+)
+from services.turn_pipeline import start_turn, collect_turn, FILLER_TEXT
+from services.phrase_library import prerender_phrases
+from services.pms_service import init_db, get_pms_cache_stats
+from services.pms_adapter import get_adapter_stats
+from services.intent_service import get_fast_path_stats
+from services.context_service import get_context_stats
+from services.session_store import get_session_stats
+from services.resilience import get_resilience_stats
+from services import admission
+from services.admission import get_admission_stats, HOLD_TEXT, BUSY_TEXT
+from services.database import reader, close_all
+from services import events_service
+from services.metrics_service import span, tag, trace_turn, observe, get_latency_summary, get_recent_turns, render_prometheus
+from services.history_service import get_recent_calls, start_writer, stop_writer, get_writer_stats, log_call_end
+from services.analytics_service import get_analytics
 
 load_dotenv()
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 
+class ClipStaticFiles(StaticFiles):
+    """
+    Clips are named by the hash of their content, so the name is a strong
+    ETag and the file never changes: Twilio and any CDN may keep it forever.
+    (mtime is the LRU clock and moves on every hit, so the default
+    mtime-based ETag would not be stable.) Range requests are handled by
+    FileResponse.
+    """
+    CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}$")
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        stem = os.path.splitext(os.path.basename(full_path))[0]
+        if self.CONTENT_ADDRESSED.match(stem):
+            response.headers["etag"] = f'"{stem}"'
+            response.headers["cache-control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["cache-control"] = "no-cache"
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
 os.makedirs("static", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", ClipStaticFiles(directory="static"), name="static")
 
 HOTEL_NAME = os.getenv("HOTEL_NAME", "Grand Hotel")
 VERSION = "3.1.0-DASHBOARD" 
 HOST_URL = os.getenv("HOST_URL", "https://hotel-agent-uwpc.onrender.com") 
 
+_background_tasks = set()
+
 @app.on_event("startup")
 async def startup_event():
     init_db()
-    # Pre-warm greeting
-    welcome_file = "static/welcome.mp3"
-    if not os.path.exists(welcome_file):
-        welcome_text = f"Welcome to {HOTEL_NAME}. I am Nasrin, your intelligent concierge."
-        await generate_audio(welcome_text, output_filename=welcome_file)
+    events_service.bind_loop()
+    await start_writer()
+    await start_session()
+    # Top up any phrases the build step could not render, without delaying
+    # startup, and keep static/ bounded
+    for coro in (prerender_phrases(), run_sweeper()):
+        task = asyncio.create_task(coro)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in list(_background_tasks):
+        task.cancel()
+    await close_session()
+    await stop_writer()
+    close_all()
 
 @app.get("/")
 async def root():
@@ -41,79 +101,310 @@ async def root():
 
 @app.get("/dashboard")
 async def dashboard(request: Request):
-    return templates.TemplateResponse("dashboard.html", {"request": request})
+    return templates.TemplateResponse(request, "dashboard.html")
+
+def render_tickets() -> str:
+    with reader() as conn:
+        tickets = conn.execute("SELECT * FROM tickets ORDER BY created_at DESC LIMIT 10").fetchall()
+    return templates.get_template("tickets_partial.html").render(tickets=tickets)
+
+def render_guests() -> str:
+    with reader() as conn:
+        guests = conn.execute("SELECT * FROM guests WHERE vip_status IN ('Platinum', 'Gold')").fetchall()
+    return templates.get_template("guests_partial.html").render(guests=guests)
+
+def render_transcripts() -> str:
+    calls = get_recent_calls(limit=3)
+    return templates.get_template("transcripts_partial.html").render(calls=calls)
+
+PARTIAL_RENDERERS = {
+    "tickets": render_tickets,
+    "guests": render_guests,
+    "transcripts": render_transcripts,
+}
+
+# Tables each partial reads. Their write counters (kept by triggers, see
+# pms_service.count_changes) move on any insert, update or delete, from any
+# process, so the sum is the partial's version.
+PARTIAL_TABLES = {
+    "tickets": ("tickets",),
+    "guests": ("guests",),
+    "transcripts": ("transcripts", "calls"),
+}
+
+_render_cache: Dict[str, Tuple[int, str]] = {}  # topic -> (version, html)
+
+def partial_version(topic: str) -> int:
+    tables = PARTIAL_TABLES[topic]
+    with reader() as conn:
+        return conn.execute(
+            f"SELECT coalesce(sum(version), 0) FROM change_counters WHERE name IN ({', '.join('?' * len(tables))})", tables
+        ).fetchone()[0]
+
+def render_partial(topic: str) -> Tuple[int, str]:
+    """
+    Returns (version, html) for a dashboard partial, re-rendering only when
+    its version has changed since the last render. Blocking (SQLite, Jinja):
+    call from a worker thread.
+    """
+    version = partial_version(topic)
+    cached = _render_cache.get(topic)
+    if cached and cached[0] == version:
+        return cached
+    _render_cache[topic] = (version, PARTIAL_RENDERERS[topic]())
+    return _render_cache[topic]
 
+def partial_response(request: Request, topic: str) -> Response:
+    version, html = render_partial(topic)
+    etag = f'"{topic}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(html, headers=headers)
+
+# Plain def: FastAPI runs these in its threadpool, off the event loop
 @app.get("/api/tickets-table")
-async def get_tickets_table(request: Request):
-    conn = get_db_connection()
-    tickets = conn.execute("SELECT * FROM tickets ORDER BY created_at DESC LIMIT 10").fetchall()
-    conn.close()
-    return templates.TemplateResponse("tickets_partial.html", {"request": request, "tickets": tickets})
+def get_tickets_table(request: Request):
+    return partial_response(request, "tickets")
 
 @app.get("/api/guests-list")
-async def get_guests_list(request: Request):
-    conn = get_db_connection()
-    guests = conn.execute("SELECT * FROM guests WHERE vip_status IN ('Platinum', 'Gold')").fetchall()
-    conn.close()
-    return templates.TemplateResponse("guests_partial.html", {"request": request, "guests": guests})
+def get_guests_list(request: Request):
+    return partial_response(request, "guests")
 
 @app.get("/api/transcripts")
-async def get_transcripts(request: Request):
-    calls = get_recent_calls(limit=3)
-    return templates.TemplateResponse("transcripts_partial.html", {"request": request, "calls": calls})
+def get_transcripts(request: Request):
+    return partial_response(request, "transcripts")
+
+def _event_id(seen: Dict[str, int]) -> str:
+    return ",".join(f"{topic}={version}" for topic, version in sorted(seen.items()))
+
+def _parse_event_id(value: Optional[str]) -> Dict[str, int]:
+    seen = {}
+    for part in (value or "").split(","):
+        topic, _, version = part.partition("=")
+        if topic in events_service.TOPICS and version.isdigit():
+            seen[topic] = int(version)
+    return seen
+
+@app.get("/api/events")
+async def dashboard_events(request: Request):
+    """
+    Server-sent events: pushes a re-rendered partial only when a call,
+    transcript line or ticket has actually been written. Each event's id
+    carries the partial versions the browser has; on (re)connect, any
+    partial that changed since (e.g. during the reconnect gap) is sent first.
+    """
+    seen = _parse_event_id(request.headers.get("last-event-id"))
+
+    async def stream():
+        sub = events_service.subscribe()
+        deadline = time.monotonic() + events_service.SSE_MAX_STREAM_SECONDS
+        topics = set(events_service.TOPICS)
+        try:
+            yield "retry: 1000\n\n"
+            while True:
+                for topic in sorted(topics):
+                    version, html = await asyncio.to_thread(render_partial, topic)
+                    if seen.get(topic) == version:
+                        continue
+                    seen[topic] = version
+                    data = "".join(f"data: {line}\n" for line in html.splitlines())
+                    yield f"event: {topic}\nid: {_event_id(seen)}\n{data}\n"
+                if time.monotonic() >= deadline:
+                    break
+                topics = await sub.wait(timeout=min(15, max(0, deadline - time.monotonic())))
+                if not topics:
+                    yield ": keep-alive\n\n"
+        finally:
+            events_service.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/latency")
+async def get_latency_panel():
+    # Changes every turn, so no ETag: the panel simply polls
+    html = templates.get_template("latency_partial.html").render(stages=get_latency_summary(), turns=get_recent_turns()[:5])
+    return HTMLResponse(html, headers={"Cache-Control": "no-cache"})
+
+async def service_stats() -> Dict:
+    return {"tts_cache": get_cache_stats(), "sessions": await get_session_stats(), "write_behind": get_writer_stats(), "pms_cache": get_pms_cache_stats(), "pms_adapter": get_adapter_stats(), "fast_path": get_fast_path_stats(), "prompt_context": get_context_stats(), "admission": get_admission_stats()}
+
+@app.get("/api/stats")
+async def stats():
+    return {**(await service_stats()), "upstreams": get_resilience_stats(), "latency": get_latency_summary()}
+
+@app.get("/api/analytics")
+async def analytics(hours: int = 24):
+    # Reads the hourly rollups only, so cost does not grow with call volume
+    return await asyncio.to_thread(get_analytics, hours)
+
+@app.get("/metrics")
+async def metrics():
+    upstreams = {f"upstream_{name}": s for name, s in get_resilience_stats().items()}
+    return PlainTextResponse(render_prometheus({**(await service_stats()), **upstreams}), media_type="text/plain; version=0.0.4")
 
 # --- VOICE ROUTES ---
 
 @app.post("/voice")
 async def voice(From: str = Form(...), CallSid: str = Form(...)):
-    clear_history(CallSid)
+    await clear_history(CallSid)
     response = VoiceResponse()
     
-    welcome_file = "static/welcome.mp3"
-    if os.path.exists(welcome_file):
+    welcome_file = phrase_path("welcome.en")
+    if welcome_file:
          clean_host = HOST_URL.rstrip("/")
          audio_url = f"{clean_host}/{welcome_file}"
          response.play(audio_url)
     else:
          response.say(f"Welcome to {HOTEL_NAME}.", voice="en-US-Neural2-F")
     
-    response.gather(input="speech", action="/handle-speech", timeout=3, language="auto")
+    gather(response)
     response.redirect("/voice")
     return Response(content=str(response), media_type="application/xml")
 
+def gather(response: VoiceResponse):
+    # Each <Gather> gets its own nonce; Twilio's retries of its POST repeat it
+    nonce = uuid.uuid4().hex[:12]
+    response.gather(input="speech", action=f"/handle-speech?gather={nonce}", timeout=3, language="auto")
+
+def retry_key(request: Request, call_sid: str, nonce: Optional[str], holds: int) -> Optional[str]:
+    """
+    Identifies one delivery of a turn's webhook, so Twilio retries can be
+    told apart from a guest saying the same thing again. None if the
+    request carries neither Twilio's idempotency token nor a Gather nonce.
+    """
+    token = request.headers.get("I-Twilio-Idempotency-Token")
+    if token:
+        return f"{call_sid}:token:{token}"
+    if nonce:
+        return f"{call_sid}:{nonce}:{holds}"
+    return None
+
+async def answer_once(key: Optional[str], handler: Callable[[], Awaitable[str]]) -> str:
+    return await (admission.once(key, handler) if key else handler())
+
 @app.post("/handle-speech")
 async def handle_speech(
+    request: Request,
     background_tasks: BackgroundTasks,
     CallSid: str = Form(...), 
     From: str = Form(...), 
-    SpeechResult: str = Form(None)
+    SpeechResult: str = Form(None),
+    gather_nonce: Optional[str] = Query(None, alias="gather"),
 ):
     response = VoiceResponse()
     
     if not SpeechResult:
-        response.say("I didn't catch that.", voice="en-US-Neural2-F")
-        response.gather(input="speech", action="/handle-speech", timeout=3, language="auto")
+        play_or_say(response, "didnt_catch.en", "I didn't catch that.")
+        gather(response)
         return Response(content=str(response), media_type="application/xml")
 
-    ai_result = await get_ai_response(CallSid, SpeechResult, From)
-    ai_text = ai_result["text"]
-    should_transfer = ai_result.get("transfer", False)
-    
-    audio_file_path = await generate_audio(ai_text)
-    
-    if audio_file_path:
-        clean_host = HOST_URL.rstrip("/")
-        audio_url = f"{clean_host}/{audio_file_path}"
-        response.play(audio_url)
+    # A Twilio retry of this turn gets the first attempt's TwiML
+    key = retry_key(request, CallSid, gather_nonce, 0)
+    twiml = await answer_once(key, lambda: answer_speech(CallSid, From, SpeechResult, gather_nonce, 0))
+    return Response(content=twiml, media_type="application/xml")
+
+@app.post("/retry-speech")
+async def retry_speech(request: Request, speech: str, holds: int, gather_nonce: Optional[str] = Query(None, alias="gather"),
+                       CallSid: str = Form(...), From: str = Form(...)):
+    # The guest was put on hold; try their turn again
+    key = retry_key(request, CallSid, gather_nonce, holds)
+    twiml = await answer_once(key, lambda: answer_speech(CallSid, From, speech, gather_nonce, holds))
+    return Response(content=twiml, media_type="application/xml")
+
+async def answer_speech(call_sid: str, caller_number: str, speech: str, nonce: Optional[str], holds: int) -> str:
+    response = VoiceResponse()
+    # FAQ turns never reach Gemini, so a saturated Gemini doesn't hold them
+    if not await admission.admit(needs_upstreams=needs_llm(speech)):
+        return hold_reply(response, speech, nonce, holds)
+
+    with trace_turn(call_sid):
+        # The slot is held until the turn's work ends, filler or not
+        ai_result, turn_id = await start_turn(call_sid, speech, caller_number, on_done=admission.release)
+        with span("twiml"):
+            if ai_result is None:
+                # Reply still being prepared: fill the silence, then collect it
+                tag("filler", True)
+                play_or_say(response, "filler.en", FILLER_TEXT)
+                response.redirect(f"/continue-speech/{turn_id}", method="POST")
+                return str(response)
+            return render_reply(response, call_sid, ai_result)
+
+def hold_reply(response: VoiceResponse, speech: str, nonce: Optional[str], holds: int) -> str:
+    next_holds = admission.next_hold(holds)
+    if next_holds is None:
+        play_or_say(response, "busy.en", BUSY_TEXT)
+        gather(response)
+        return str(response)
+    play_or_say(response, "hold.en", HOLD_TEXT)
+    response.pause(length=admission.HOLD_PAUSE_SECONDS)
+    query = {"speech": speech, "holds": next_holds, **({"gather": nonce} if nonce else {})}
+    response.redirect(f"/retry-speech?{urlencode(query)}", method="POST")
+    return str(response)
+
+@app.post("/call-status")
+async def call_status(CallSid: str = Form(...), CallStatus: str = Form(...), CallDuration: int = Form(None)):
+    # Twilio status callback: finalize the call once it has ended
+    if CallStatus in ("completed", "busy", "failed", "no-answer", "canceled"):
+        log_call_end(CallSid, CallStatus, CallDuration)
+        await clear_history(CallSid)
+    return Response(status_code=204)
+
+@app.post("/continue-speech/{turn_id}")
+async def continue_speech(turn_id: str, CallSid: str = Form(...)):
+    response = VoiceResponse()
+    ai_result = await collect_turn(turn_id)
+    if ai_result is None:
+        ai_result = {**FALLBACK_RESPONSE, "segments": [{"text": FALLBACK_RESPONSE["text"], "path": phrase_path("fallback.en"), "stream": False}]}
+    return Response(content=render_reply(response, CallSid, ai_result), media_type="application/xml")
+
+def play_or_say(response: VoiceResponse, phrase: str, text: str):
+    path = phrase_path(phrase)
+    if path:
+        response.play(f"{HOST_URL.rstrip('/')}/{path}")
     else:
-        response.say(ai_text, voice=ai_result["voice"])
-        
-    if should_transfer:
+        response.say(text, voice="en-US-Neural2-F")
+
+def render_reply(response: VoiceResponse, call_sid: str, ai_result: Dict) -> str:
+    clean_host = HOST_URL.rstrip("/")
+    for segment in ai_result["segments"]:
+        if segment["path"]:
+            response.play(f"{clean_host}/{segment['path']}")
+        elif segment["stream"]:
+            # Synthesized (or already being synthesized) when Twilio fetches it
+            response.play(f"{clean_host}/tts-stream/{register_stream(call_sid, segment['text'])}.{AUDIO_EXT}")
+        else:
+            response.say(segment["text"], voice=ai_result["voice"])
+
+    if ai_result.get("transfer", False):
         response.dial("+14169006975")
     else:
-        response.gather(input="speech", action="/handle-speech", timeout=3, language="auto")
-    
-    return Response(content=str(response), media_type="application/xml")
+        gather(response)
+    return str(response)
+
+@app.get("/tts-stream/{stream_id}.{ext}")
+async def tts_stream(stream_id: str, ext: str):
+    text = get_stream_text(stream_id)
+    if text is None:
+        return Response(status_code=404)
+
+    # A segment already synthesized, or being synthesized, for this turn
+    audio_file_path = await wait_for_audio(text)
+    if audio_file_path:
+        return FileResponse(audio_file_path, media_type=audio_media_type(audio_file_path))
+
+    # Time until ElevenLabs starts sending audio; the rest of the clip streams
+    start = time.perf_counter()
+    stream = await open_audio_stream(text)
+    observe("tts_stream_first_byte", time.perf_counter() - start)
+    if stream is None:
+        # Streaming refused: synthesize the whole clip the regular way
+        audio_file_path = await generate_audio(text)
+        if not audio_file_path:
+            return Response(status_code=502)
+        return FileResponse(audio_file_path, media_type=audio_media_type(audio_file_path))
+
+    return StreamingResponse(stream, media_type=AUDIO_MEDIA_TYPE)
 
 if __name__ == "__main__":
     import uvicorn
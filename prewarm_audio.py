@@ -1,15 +1,21 @@
-import os
-from services.tts_service import generate_audio
+import asyncio
+from services.phrase_library import prerender_phrases, PRERENDER_CONCURRENCY
+from services.tts_service import close_session
 
-# Pre-generate the welcome message so there is NO latency on call pickup
-HOTEL_NAME = os.getenv("HOTEL_NAME", "Grand Hotel")
-WELCOME_TEXT = f"Welcome to {HOTEL_NAME}! It is my absolute pleasure to serve you. How may I brighten your stay today?"
+# Pre-render the phrase library (greetings, fixed replies, FAQ answers) so
+# there is NO latency on call pickup or on the most common questions
 
-print("Generating 'welcome.mp3'...")
-path = generate_audio(WELCOME_TEXT, output_filename="static/welcome.mp3")
+async def main():
+    print(f"Pre-rendering phrase library ({PRERENDER_CONCURRENCY} at a time)...")
+    try:
+        results = await prerender_phrases()
+    finally:
+        await close_session()
 
-if path:
-    print(f"Success! Saved to {path}")
-else:
-    print("Failed to generate welcome audio.")
+    failed = [name for name, path in results.items() if not path]
+    print(f"Rendered {len(results) - len(failed)}/{len(results)} phrases.")
+    for name in failed:
+        print(f"Failed: {name}")
 
+if __name__ == "__main__":
+    asyncio.run(main())
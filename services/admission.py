@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+from services import resilience
+
+logger = logging.getLogger(__name__)
+
+# Admission control for speech turns. At most ADMISSION_MAX_TURNS run at once;
+# up to ADMISSION_QUEUE_SIZE more wait ADMISSION_QUEUE_SECONDS for a slot.
+# Beyond that, or while an upstream a turn needs is at its in-flight budget
+# (turns the FAQ fast path answers need none), the caller is put on hold (a pre-rendered "please hold" and a redirect that
+# retries the turn) instead of every turn slowing down together.
+ADMISSION_MAX_TURNS = int(os.getenv("ADMISSION_MAX_TURNS", "32"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_QUEUE_SECONDS = float(os.getenv("ADMISSION_QUEUE_SECONDS", "2"))
+# Holds per turn before giving up and asking the guest to try again
+ADMISSION_MAX_HOLDS = int(os.getenv("ADMISSION_MAX_HOLDS", "2"))
+HOLD_PAUSE_SECONDS = 2
+TURN_UPSTREAMS = ("gemini",)
+# Twilio retries a webhook it got no answer to; a retry of a turn (same
+# idempotency token or Gather nonce, never merely the same words) within this
+# window of it finishing, or while it runs, gets the same TwiML
+RETRY_WINDOW_SECONDS = float(os.getenv("RETRY_WINDOW_SECONDS", "10"))
+
+HOLD_TEXT = "Thank you for your patience, please hold for just a moment."
+BUSY_TEXT = "I'm so sorry, we're very busy right now. Could you say that again in a moment?"
+
+admission_stats = {"admitted": 0, "queued": 0, "held": 0, "timeouts": 0, "upstream_busy": 0, "gave_up": 0, "duplicates": 0}
+
+class Budget:
+    """
+    A counting semaphore with a bounded, deadline-limited queue. Slots are
+    handed to waiters in arrival order.
+    """
+    def __init__(self, limit: int, queue_size: int, queue_seconds: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_seconds = queue_seconds
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+        admission_stats["queued"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_seconds)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if waiter.done():
+            return True
+        self._abandon(waiter)
+        admission_stats["timeouts"] += 1
+        return False
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done():
+            # Granted just as we gave up: pass the slot on
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)  # the slot moves to the waiter
+                return
+        self.active -= 1
+
+turns = Budget(ADMISSION_MAX_TURNS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_SECONDS)
+
+async def admit(needs_upstreams: bool = True) -> bool:
+    """
+    Takes a turn slot, waiting briefly if need be. False means hold the
+    caller. Every True must be matched by a release(). needs_upstreams=False
+    (a fast-path turn) skips the upstream saturation check.
+    """
+    for name in TURN_UPSTREAMS if needs_upstreams else ():
+        upstream = resilience.get_upstream(name)
+        if upstream is not None and upstream.saturated():
+            admission_stats["upstream_busy"] += 1
+            admission_stats["held"] += 1
+            return False
+    if await turns.acquire():
+        admission_stats["admitted"] += 1
+        return True
+    admission_stats["held"] += 1
+    return False
+
+def release():
+    turns.release()
+
+def next_hold(holds: int) -> Optional[int]:
+    """
+    The hold count for the retry after this one, or None once the turn has
+    been held ADMISSION_MAX_HOLDS times and the guest should try again.
+    """
+    if holds >= ADMISSION_MAX_HOLDS:
+        admission_stats["gave_up"] += 1
+        return None
+    return holds + 1
+
+# --- TWILIO RETRY DEDUPLICATION ---
+
+_recent_turns: Dict[str, Tuple[Optional[float], asyncio.Task]] = {}  # key -> (finished_at, turn)
+
+def _sweep_recent():
+    now = time.monotonic()
+    for key, (finished_at, _) in list(_recent_turns.items()):
+        if finished_at is not None and now - finished_at > RETRY_WINDOW_SECONDS:
+            del _recent_turns[key]
+
+def _finished(key: str, task: asyncio.Task):
+    if task.cancelled() or task.exception() is not None:
+        # Let a retry run the turn afresh
+        _recent_turns.pop(key, None)
+    else:
+        _recent_turns[key] = (time.monotonic(), task)
+
+async def once(key: str, handler: Callable[[], Awaitable[str]]) -> str:
+    """
+    Runs handler once per key. A repeat while it runs, or shortly after,
+    gets the same TwiML instead of running the turn (and its tools) again.
+    The turn runs as its own task, so it survives the first request being
+    dropped, which is exactly when Twilio retries.
+    """
+    _sweep_recent()
+    entry = _recent_turns.get(key)
+    if entry is not None:
+        admission_stats["duplicates"] += 1
+        logger.info(f"Duplicate webhook for {key}; replaying the first response")
+        task = entry[1]
+    else:
+        task = asyncio.ensure_future(handler())
+        _recent_turns[key] = (None, task)
+        task.add_done_callback(lambda t: _finished(key, t))
+    return await asyncio.shield(task)
+
+def get_admission_stats() -> Dict:
+    return {
+        **admission_stats,
+        "active": turns.active,
+        "waiting": len(turns._waiters),
+        "max_turns": turns.limit,
+    }
@@ -1,26 +1,82 @@
 import os
+import re
+import time
+import asyncio
+import threading
+import traceback
 import google.generativeai as genai
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from typing import Callable, List, Dict, Optional, Tuple
 import json
 import logging
-from services.pms_service import get_active_booking, create_ticket, get_bill_details, get_guest_details
-from services.history_service import log_call_start, log_transcript
+from services import pms_adapter
+from services.pms_service import format_bill
+from services.history_service import log_call_start, log_transcript, log_call_event
+from services.guest_service import get_guest_profile, get_profile_version, save_last_order
+from services.session_store import get_session_store
+from services.intent_service import match_intent, can_answer
+from services.context_service import select_sections, render_context, record as record_context
+from services.metrics_service import span, tag, observe
+from services import resilience
+from services.resilience import UpstreamError, RejectedError
 
 logger = logging.getLogger(__name__)
 
-conversation_history: Dict[str, List[Dict[str, str]]] = {}
+# GEMINI_API_ENDPOINT (host:port) points the client at a local stand-in for benchmarks
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+genai.configure(
+    api_key=os.getenv("GEMINI_API_KEY"),
+    client_options={"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None,
+)
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+HOTEL_INFO_FILE = "data/hotel_info.json"
+HOTEL_INFO: Dict = {}
+_hotel_info_version: Optional[int] = None
+_static_prompt = ""
 
-try:
-    with open("data/hotel_info.json", "r") as f:
-        HOTEL_INFO = json.load(f)
-except:
-    HOTEL_INFO = {}
+def refresh_hotel_info() -> int:
+    """
+    Reloads hotel_info.json when its mtime changes. Returns the version
+    (mtime in ns, 0 if the file is missing) used as a prompt cache key.
+    """
+    global HOTEL_INFO, _hotel_info_version, _static_prompt
+    try:
+        version = os.stat(HOTEL_INFO_FILE).st_mtime_ns
+    except OSError:
+        version = 0
+    if version != _hotel_info_version:
+        try:
+            with open(HOTEL_INFO_FILE, "r") as f:
+                HOTEL_INFO = json.load(f)
+        except:
+            HOTEL_INFO = {}
+        _hotel_info_version = version
+        _static_prompt = _build_static_prompt()
+    return version
 
 HOTEL_NAME = os.getenv("HOTEL_NAME", "Grand Hotel")
 AI_TEMPERATURE = float(os.getenv("AI_TEMPERATURE", "0.4"))
 
+# Gemini runs on its async client; this bounds how many turns may be waiting
+# on it at once and how long any one turn may wait.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "8"))
+_llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+# Turns running plus waiting on the semaphore; beyond this the admission
+# controller puts callers on hold rather than queue them here
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", str(2 * LLM_MAX_CONCURRENCY)))
+gemini = resilience.register("gemini", LLM_TIMEOUT_SECONDS, max_in_flight=GEMINI_MAX_IN_FLIGHT)
+# Stream the reply and hand out sentences as they complete (see ReplyTextStream)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() == "true"
+
+# Compiled models are reused across turns. The key is the guest's profile
+# version plus a time bucket, since the prompt embeds the current time.
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "256"))
+PROMPT_TIME_BUCKET_SECONDS = int(os.getenv("PROMPT_TIME_BUCKET_SECONDS", "300"))
+_model_cache: "OrderedDict[Tuple, genai.GenerativeModel]" = OrderedDict()
+model_cache_stats = {"hits": 0, "misses": 0}
+_model_cache_lock = threading.Lock()
+
 generation_config = {
     "temperature": AI_TEMPERATURE,
     "top_p": 0.95,
@@ -75,12 +131,41 @@ tools = [
 
 import datetime
 
-def get_system_prompt(guest_profile: Dict) -> str:
+def _build_static_prompt() -> str:
+    # Everything that does not change per guest, per topic or per minute goes
+    # first, so the prompt prefix stays byte-identical across turns and guests.
+    return f"""
+You are Nasrin, the Advanced AI Hotel Manager at {HOTEL_NAME}.
+GOAL: Provide "Better than Human" service using Real Knowledge and Actions.
+
+RULES:
+1. **Identify the Guest**: Use their name naturally.
+2. **Time Awareness**: If a guest orders Breakfast at 8 PM, politely decline and suggest All-Day items.
+3. **Smart Upselling**: If they order food, ALWAYS suggest a matching drink or side. (e.g., "Would you like a glass of Cabernet with that Steak?").
+4. **Take Action**: Use tools for tickets/bills.
+5. **Transfer**: If the guest is angry, confused, or asks for a human, use `transfer_call`.
+6. **Be Concise**: 1-2 sentences max.
+
+OUTPUT FORMAT (JSON):
+{{
+  "text": "Spoken response",
+  "language_code": "2-letter ISO code",
+  "transfer": boolean
+}}
+"""
+
+def get_system_prompt(guest_profile: Dict, now: Optional[datetime.datetime] = None,
+                      sections: Optional[Tuple[str, ...]] = None) -> str:
+    """
+    sections limits HOTEL AMENITIES to what the turn needs (see
+    context_service); None sends all of HOTEL_INFO.
+    """
+    refresh_hotel_info()
     guest_name = guest_profile.get("name", "Guest")
     last_order = guest_profile.get("last_order")
     
     # Time Awareness
-    now = datetime.datetime.now()
+    now = now or datetime.datetime.now()
     current_time_str = now.strftime("%I:%M %p")
     current_day = now.strftime("%A")
     
@@ -90,62 +175,283 @@ def get_system_prompt(guest_profile: Dict) -> str:
     if last_order:
         context += f"Last Order: {last_order}\n"
 
-    return f"""
-You are Nasrin, the Advanced AI Hotel Manager at {HOTEL_NAME}.
-GOAL: Provide "Better than Human" service using Real Knowledge and Actions.
+    amenities = json.dumps(render_context(HOTEL_INFO, sections), indent=2)
+
+    return f"""{_static_prompt}
+HOTEL AMENITIES:
+{amenities}
 
 CURRENT TIME: {current_time_str} on {current_day}
 (Use this to enforce menu hours: Breakfast 6-11am, All-Day 11am-10pm, Late Night 10pm-6am).
 
 CURRENT GUEST CONTEXT:
-{context}
+{context}"""
 
-HOTEL AMENITIES:
-{json.dumps(HOTEL_INFO, indent=2)}
+def get_model(caller_number: str, utterances: Optional[List[str]] = None) -> genai.GenerativeModel:
+    """
+    Returns the compiled model for this caller, rebuilding it only when the
+    hotel info, the guest record, the time bucket or the set of hotel info
+    sections the recent utterances need has changed.
+    """
+    bucket = int(time.time() // PROMPT_TIME_BUCKET_SECONDS)
+    bucket_start = datetime.datetime.fromtimestamp(bucket * PROMPT_TIME_BUCKET_SECONDS)
+    version = refresh_hotel_info()
+    sections = None
+    if utterances is not None:
+        sections = select_sections(HOTEL_INFO, utterances, bucket_start, version)
+    key = (caller_number, get_profile_version(caller_number), version, bucket, sections)
+    record_context(HOTEL_INFO, version, sections)
 
-RULES:
-1. **Identify the Guest**: Use their name naturally.
-2. **Time Awareness**: If a guest orders Breakfast at 8 PM, politely decline and suggest All-Day items.
-3. **Smart Upselling**: If they order food, ALWAYS suggest a matching drink or side. (e.g., "Would you like a glass of Cabernet with that Steak?").
-4. **Take Action**: Use tools for tickets/bills.
-5. **Transfer**: If the guest is angry, confused, or asks for a human, use `transfer_call`.
-6. **Be Concise**: 1-2 sentences max.
+    with _model_cache_lock:
+        model = _model_cache.get(key)
+        if model is not None:
+            model_cache_stats["hits"] += 1
+            _model_cache.move_to_end(key)
+            return model
+        model_cache_stats["misses"] += 1
 
-OUTPUT FORMAT (JSON):
-{{
-  "text": "Spoken response",
-  "language_code": "2-letter ISO code",
-  "transfer": boolean
-}}
-"""
+    model = genai.GenerativeModel(
+        model_name="models/gemini-2.0-flash",
+        generation_config=generation_config,
+        system_instruction=get_system_prompt(get_guest_profile(caller_number), now=bucket_start, sections=sections),
+        tools=tools
+    )
+    with _model_cache_lock:
+        _model_cache[key] = model
+        while len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return model
+
+refresh_hotel_info()
+
+FALLBACK_RESPONSE = {"text": "I'm sorry, I didn't quite catch that. Could you say it again?", "voice": "en-US-Neural2-F", "transfer": False}
+# Fixed replies, also pre-rendered by the phrase library
+TRANSFER_TEXT = "I am connecting you to a manager right away. Please hold."
+TOOL_BUSY_TEXT = "I tried to process that request, but our system is momentarily busy. I've noted it down."
+ON_IT_TEXT = "I'm on it."
+
+class ReplyTextStream:
+    """
+    Incrementally decodes the "text" field of the model's JSON reply from
+    streamed chunks and returns each sentence once it is complete.
+    Sentences shorter than MIN_SENTENCE_CHARS are merged into the next.
+    """
+    MIN_SENTENCE_CHARS = 20
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "n": "\n", "t": "\t", "r": "", "b": "", "f": ""}
+    _KEY = re.compile(r'"text"\s*:\s*"')
+    _SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+    def __init__(self):
+        self.raw = ""
+        self.pos: Optional[int] = None  # next undecoded index inside the string
+        self.pending = ""  # decoded text not yet returned
+        self.done = False
+
+    def feed(self, chunk: str) -> List[str]:
+        self.raw += chunk
+        if self.done:
+            return []
+        if self.pos is None:
+            match = self._KEY.search(self.raw)
+            if not match:
+                return []
+            self.pos = match.end()
+        self._decode()
+        return self._sentences(final=self.done)
+
+    def close(self) -> List[str]:
+        """
+        Whatever is left once the stream has ended.
+        """
+        if self.done:
+            return []
+        self.done = True
+        return self._sentences(final=True)
+
+    def _decode(self):
+        raw, i = self.raw, self.pos
+        while i < len(raw):
+            ch = raw[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != "\\":
+                self.pending += ch
+                i += 1
+                continue
+            # Escape sequence, possibly split across chunks
+            if i + 1 >= len(raw):
+                break
+            if raw[i + 1] == "u":
+                if i + 6 > len(raw):
+                    break
+                code = int(raw[i + 2:i + 6], 16)
+                if 0xD800 <= code < 0xDC00:
+                    # High surrogate: characters outside the BMP (emoji)
+                    # arrive as a pair of escapes, possibly split across chunks
+                    if i + 12 > len(raw) and "\\u".startswith(raw[i + 6:i + 8]):
+                        break
+                    if raw[i + 6:i + 8] == "\\u" and 0xDC00 <= int(raw[i + 8:i + 12], 16) < 0xE000:
+                        low = int(raw[i + 8:i + 12], 16)
+                        self.pending += chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00))
+                        i += 12
+                        continue
+                    code = 0xFFFD
+                elif 0xDC00 <= code < 0xE000:
+                    code = 0xFFFD  # lone low surrogate
+                self.pending += chr(code)
+                i += 6
+            else:
+                self.pending += self.ESCAPES.get(raw[i + 1], raw[i + 1])
+                i += 2
+        self.pos = i
+
+    def _sentences(self, final: bool) -> List[str]:
+        sentences, start = [], 0
+        for boundary in self._SENTENCE_END.finditer(self.pending):
+            if boundary.start() - start >= self.MIN_SENTENCE_CHARS:
+                sentences.append(self.pending[start:boundary.start()].strip())
+                start = boundary.end()
+        # The tail is still being written unless the string has ended
+        rest = self.pending[start:]
+        self.pending = "" if final else rest
+        if final and rest.strip():
+            sentences.append(rest.strip())
+        return sentences
+
+async def _send_message(chat, user_input: str):
+    return await chat.send_message_async(user_input, request_options={"timeout": LLM_TIMEOUT_SECONDS})
 
-async def get_ai_response(call_sid: str, user_input: str, caller_number: str) -> Dict[str, any]:
+async def _stream_message(chat, user_input: str, on_sentence: Callable[[str], None]):
+    """
+    Streaming variant of _send_message: calls on_sentence for each complete
+    sentence of the reply text while the rest is still being generated.
+    The returned response is fully consumed, so text, parts and the chat
+    history are available as usual.
+    """
+    start = time.perf_counter()
+    response = await chat.send_message_async(user_input, stream=True, request_options={"timeout": LLM_TIMEOUT_SECONDS})
+    text_stream = ReplyTextStream()
+    first = True
+    async for chunk in response:
+        try:
+            piece = chunk.text
+        except ValueError:
+            # Function call chunk: handled after the stream ends
+            continue
+        for sentence in text_stream.feed(piece):
+            if first:
+                observe("llm_first_sentence", time.perf_counter() - start)
+                first = False
+            on_sentence(sentence)
+    for sentence in text_stream.close():
+        on_sentence(sentence)
+    return response
+
+async def _run_tool(fn, caller_number: str) -> Dict[str, any]:
+    """
+    Executes one function call from the model. PMS calls go through the
+    async adapter, which applies its own deadline and concurrency limit.
+    """
+    if fn.name == "create_maintenance_ticket":
+        typ = fn.args.get("issue_type", "Concierge")
+        desc = fn.args.get("description", "Issue")
+        tkt_id = await pms_adapter.create_ticket(caller_number, typ, desc)
+        return {"text": f"I have logged that for you. Ticket {tkt_id} created.", "ticket": tkt_id.startswith("TKT-")}
+
+    elif fn.name == "check_bill":
+        bill_info = format_bill(await pms_adapter.get_folio(caller_number))
+        return {"text": f"{bill_info}"}
+
+    elif fn.name == "book_room_service":
+        item = fn.args.get("item", "Food")
+        # Fix: Ensure quantity is handled if AI sends it, or default to 1
+        qty = int(fn.args.get("quantity", 1))
+        # Save order to DB
+        await asyncio.to_thread(save_last_order, caller_number, f"{qty} x {item}")
+        return {"text": f"I've ordered {qty} x {item} for you."}
+
+    elif fn.name == "transfer_call":
+        return {"text": TRANSFER_TEXT, "transfer": True}
+
+    return {}
+
+async def get_ai_response(call_sid: str, user_input: str, caller_number: str,
+                          on_sentence: Optional[Callable[[str], None]] = None) -> Dict[str, any]:
+    """
+    One conversational turn. With LLM_STREAMING and an on_sentence callback,
+    sentences of the reply are passed to it as they are generated; the
+    returned text is still the final, authoritative reply (a tool result
+    may replace what was streamed).
+    """
     try:
-        if call_sid not in conversation_history:
-             conversation_history[call_sid] = []
-             log_call_start(call_sid, caller_number)
-
-        log_transcript(call_sid, "user", user_input)
-
-        model = genai.GenerativeModel(
-            model_name="models/gemini-2.0-flash",
-            generation_config=generation_config,
-            system_instruction=get_system_prompt(get_guest_profile(caller_number)),
-            tools=tools
-        )
-
-        chat = model.start_chat(history=conversation_history[call_sid])
-        response = chat.send_message(user_input)
-        
+        sessions = get_session_store()
+        with span("session"):
+            history = await sessions.get(call_sid)
+            new_call = history is None
+            if new_call:
+                 history = []
+                 await sessions.set(call_sid, history)
+        with span("db_log"):
+            if new_call:
+                log_call_start(call_sid, caller_number)
+            log_transcript(call_sid, "user", user_input)
+
+        # FAQ turns answered straight from HOTEL_INFO skip the LLM entirely
+        with span("intent"):
+            # Reload first: HOTEL_INFO must be read after the refresh
+            version = refresh_hotel_info()
+            fast = match_intent(user_input, HOTEL_INFO, version)
+        if fast:
+            tag("path", "fast")
+            reply = {"text": fast["text"], "language_code": fast["language_code"], "transfer": False}
+            history.append({"role": "user", "parts": [{"text": user_input}]})
+            history.append({"role": "model", "parts": [{"text": json.dumps(reply)}]})
+            with span("session"):
+                await sessions.set(call_sid, history)
+            with span("db_log"):
+                log_transcript(call_sid, "assistant", fast["text"])
+            voice = VOICE_MAP.get(fast["language_code"], "en-US-Neural2-F")
+            return {"text": fast["text"], "voice": voice, "transfer": False, "fast_path": True}
+
+        tag("path", "llm")
+        with span("prompt_build"):
+            utterances = [part.get("text", "") for content in history if content.get("role") == "user"
+                          for part in content.get("parts", [])]
+            model = await asyncio.to_thread(get_model, caller_number, utterances + [user_input])
+            chat = model.start_chat(history=history)
+        try:
+            with span("llm"):
+                if LLM_STREAMING and on_sentence is not None:
+                    message = _stream_message(chat, user_input, on_sentence)
+                else:
+                    message = _send_message(chat, user_input)
+                # The semaphore is waited for outside the Gemini deadline
+                response = await gemini.call(lambda: message, queue=_llm_semaphore)
+        except UpstreamError as e:
+            message.close()
+            # Rejections (breaker open, over budget) are counted, not logged per turn
+            if not isinstance(e, RejectedError):
+                logger.error(f"Gemini unavailable for {call_sid}: {e}")
+            tag("path", "llm_unavailable")
+            return dict(FALLBACK_RESPONSE)
+
         transfer_flag = False
-        
+
+        try:
+            raw_text = response.text
+        except ValueError:
+            # Function-call-only turns have no text part
+            raw_text = ""
+
         try:
-            data = json.loads(response.text)
+            data = json.loads(raw_text)
             text = data.get("text", "")
             lang = data.get("language_code", "en")
             transfer_flag = data.get("transfer", False)
         except:
-            text = response.text
+            text = raw_text
             lang = "en"
 
         # Handle Function Calls
@@ -153,51 +459,42 @@ async def get_ai_response(call_sid: str, user_input: str, caller_number: str) ->
              for part in response.parts:
                 if fn := part.function_call:
                     try:
-                        if fn.name == "create_maintenance_ticket":
-                            typ = fn.args.get("issue_type", "Concierge")
-                            desc = fn.args.get("description", "Issue")
-                            tkt_id = create_ticket(caller_number, typ, desc)
-                            text = f"I have logged that for you. Ticket {tkt_id} created."
-                        
-                        elif fn.name == "check_bill":
-                            bill_info = get_bill_details(caller_number)
-                            text = f"{bill_info}"
-
-                        elif fn.name == "book_room_service":
-                            item = fn.args.get("item", "Food")
-                            # Fix: Ensure quantity is handled if AI sends it, or default to 1
-                            qty = int(fn.args.get("quantity", 1))
-                            text = f"I've ordered {qty} x {item} for you."
-                            # Save order to DB
-                            save_last_order(caller_number, f"{qty} x {item}")
-                        
-                        elif fn.name == "transfer_call":
-                            transfer_flag = True
-                            text = "I am connecting you to a manager right away. Please hold."
-                            
+                        with span(f"tool.{fn.name}"):
+                            result = await _run_tool(fn, caller_number)
+                        text = result.get("text", text)
+                        transfer_flag = result.get("transfer", transfer_flag)
+                        if result.get("ticket"):
+                            log_call_event(call_sid, "ticket")
                     except Exception as tool_err:
                         logger.error(f"Tool Execution Failed: {tool_err}")
-                        text = "I tried to process that request, but our system is momentarily busy. I've noted it down."
+                        text = TOOL_BUSY_TEXT
 
         if not text:
-            text = "I'm on it."
+            text = ON_IT_TEXT
 
         voice = VOICE_MAP.get(lang, "en-US-Neural2-F")
-        conversation_history[call_sid] = chat.history
-        
-        log_transcript(call_sid, "assistant", text)
+        with span("session"):
+            await sessions.set(call_sid, [type(content).to_dict(content) for content in chat.history])
 
-        return {"text": text, "voice": voice, "transfer": transfer_flag}
-        
-import traceback
+        with span("db_log"):
+            log_transcript(call_sid, "assistant", text)
+            if transfer_flag:
+                log_call_event(call_sid, "transfer")
 
-# ... (inside get_ai_response)
+        return {"text": text, "voice": voice, "transfer": transfer_flag}
 
     except Exception as e:
         logger.error(f"CRITICAL ERROR in AI Service: {e}")
         logger.error(traceback.format_exc())
-        return {"text": "I'm sorry, I didn't quite catch that. Could you say it again?", "voice": "en-US-Neural2-F", "transfer": False}
+        tag("path", "error")
+        return dict(FALLBACK_RESPONSE)
+
+def needs_llm(user_input: str) -> bool:
+    """
+    Whether this turn will call Gemini, i.e. the FAQ fast path can't answer it.
+    """
+    version = refresh_hotel_info()
+    return not can_answer(user_input, HOTEL_INFO, version)
 
-def clear_history(call_sid: str):
-    if call_sid in conversation_history:
-        del conversation_history[call_sid]
+async def clear_history(call_sid: str):
+    await get_session_store().delete(call_sid)
@@ -0,0 +1,176 @@
+import logging
+import datetime
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from services.database import reader
+
+logger = logging.getLogger(__name__)
+
+# Call analytics materialized at write time. The write-behind flush hands
+# each batch of calls, transcript lines and call events to apply(), which
+# updates per-call counters (call_stats) and hourly rollups in the same
+# transaction. Reporting reads the rollups, never the transcripts.
+SUMMARY_OPENING_CHARS = 80
+MAX_ANALYTICS_HOURS = 24 * 31
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS call_stats (
+        call_sid TEXT PRIMARY KEY,
+        guest_phone TEXT,
+        started_at DATETIME,
+        last_activity_at DATETIME,
+        ended_at DATETIME,
+        turns INTEGER DEFAULT 0,
+        replies INTEGER DEFAULT 0,
+        tickets INTEGER DEFAULT 0,
+        transfers INTEGER DEFAULT 0,
+        duration_seconds INTEGER,
+        first_utterance TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS call_rollups_hourly (
+        hour DATETIME PRIMARY KEY,
+        calls INTEGER DEFAULT 0,
+        turns INTEGER DEFAULT 0,
+        tickets INTEGER DEFAULT 0,
+        transfers INTEGER DEFAULT 0,
+        ended_calls INTEGER DEFAULT 0,
+        total_duration_seconds INTEGER DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_call_stats_open ON call_stats(started_at) WHERE ended_at IS NULL",
+]
+
+ROLLUP_COLUMNS = ("calls", "turns", "tickets", "transfers", "ended_calls", "total_duration_seconds")
+
+def _hour(timestamp: str) -> str:
+    # Timestamps are "YYYY-MM-DD HH:MM:SS" (UTC)
+    return f"{timestamp[:13]}:00:00"
+
+def _seconds_between(start: str, end: str) -> int:
+    fmt = "%Y-%m-%d %H:%M:%S"
+    return max(0, int((datetime.datetime.strptime(end, fmt) - datetime.datetime.strptime(start, fmt)).total_seconds()))
+
+def apply(conn, calls: List[Tuple], transcripts: List[Tuple], events: List[Tuple], ends: List[Tuple]):
+    """
+    Folds one write-behind batch into call_stats and the hourly rollups.
+    calls: (call_sid, phone, ts); transcripts: (call_sid, role, content, ts);
+    events: (call_sid, kind, ts) with kind "ticket" or "transfer";
+    ends: (call_sid, status, duration_seconds or None, ts).
+    """
+    rollups: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(ROLLUP_COLUMNS, 0))
+
+    for call_sid, phone, ts in calls:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO call_stats (call_sid, guest_phone, started_at, last_activity_at) VALUES (?, ?, ?, ?)",
+            (call_sid, phone, ts, ts),
+        )
+        if cursor.rowcount:
+            rollups[_hour(ts)]["calls"] += 1
+
+    per_call: Dict[str, Dict] = {}
+    for call_sid, role, content, ts in transcripts:
+        stats = per_call.setdefault(call_sid, {"turns": 0, "replies": 0, "last": ts, "first_utterance": None})
+        stats["last"] = max(stats["last"], ts)
+        if role == "user":
+            stats["turns"] += 1
+            rollups[_hour(ts)]["turns"] += 1
+            if stats["first_utterance"] is None:
+                stats["first_utterance"] = content[:SUMMARY_OPENING_CHARS]
+        else:
+            stats["replies"] += 1
+    for call_sid, kind, ts in events:
+        stats = per_call.setdefault(call_sid, {"turns": 0, "replies": 0, "last": ts, "first_utterance": None})
+        stats[kind] = stats.get(kind, 0) + 1
+        rollups[_hour(ts)][f"{kind}s"] += 1
+
+    conn.executemany(
+        """
+        UPDATE call_stats SET
+            turns = turns + ?, replies = replies + ?, tickets = tickets + ?, transfers = transfers + ?,
+            last_activity_at = MAX(COALESCE(last_activity_at, ''), ?),
+            first_utterance = COALESCE(first_utterance, ?)
+        WHERE call_sid = ?
+        """,
+        [
+            (s["turns"], s["replies"], s.get("ticket", 0), s.get("transfer", 0), s["last"], s["first_utterance"], call_sid)
+            for call_sid, s in per_call.items()
+        ],
+    )
+
+    for call_sid, status, duration, ts in ends:
+        row = conn.execute("SELECT * FROM call_stats WHERE call_sid = ?", (call_sid,)).fetchone()
+        if row is None or row["ended_at"] is not None:
+            continue  # unknown call, or a repeated status callback
+        if duration is None:
+            duration = _seconds_between(row["started_at"], ts)
+        if row["transfers"] and status == "completed":
+            status = "transferred"
+        conn.execute("UPDATE call_stats SET ended_at = ?, duration_seconds = ? WHERE call_sid = ?", (ts, duration, call_sid))
+        conn.execute("UPDATE calls SET status = ?, summary = ? WHERE call_sid = ?", (status, summarize(row, duration), call_sid))
+        rollups[_hour(ts)]["ended_calls"] += 1
+        rollups[_hour(ts)]["total_duration_seconds"] += duration
+
+    conn.executemany(
+        f"""
+        INSERT INTO call_rollups_hourly (hour, {", ".join(ROLLUP_COLUMNS)}) VALUES (?, {", ".join("?" * len(ROLLUP_COLUMNS))})
+        ON CONFLICT(hour) DO UPDATE SET {", ".join(f"{c} = {c} + excluded.{c}" for c in ROLLUP_COLUMNS)}
+        """,
+        [(hour, *(counts[c] for c in ROLLUP_COLUMNS)) for hour, counts in rollups.items()],
+    )
+
+def summarize(row, duration: int) -> str:
+    """
+    One-line call summary from the counters, e.g.
+    '3 turns in 1m 05s, 1 ticket, transferred. Opened with: "The AC is broken"'.
+    """
+    parts = [f"{row['turns']} turn{'s' if row['turns'] != 1 else ''} in {duration // 60}m {duration % 60:02d}s"]
+    if row["tickets"]:
+        parts.append(f"{row['tickets']} ticket{'s' if row['tickets'] != 1 else ''}")
+    if row["transfers"]:
+        parts.append("transferred")
+    summary = ", ".join(parts) + "."
+    if row["first_utterance"]:
+        summary += f' Opened with: "{row["first_utterance"]}"'
+    return summary
+
+def backfill_analytics(conn):
+    """
+    Migration: builds call_stats and the rollups from the calls and
+    transcripts recorded before analytics existed (one full scan, once).
+    """
+    for statement in SCHEMA:
+        conn.execute(statement)
+    calls = [tuple(r) for r in conn.execute("SELECT call_sid, guest_phone, start_time FROM calls WHERE start_time IS NOT NULL")]
+    transcripts = [tuple(r) for r in conn.execute(
+        "SELECT call_sid, role, content, timestamp FROM transcripts WHERE timestamp IS NOT NULL ORDER BY timestamp, id"
+    )]
+    apply(conn, calls, transcripts, [], [])
+    logger.info(f"Backfilled analytics for {len(calls)} calls")
+
+def get_analytics(hours: int = 24) -> Dict:
+    """
+    Totals and per-hour rows for the last `hours` hours, read from the
+    rollups (plus the open-calls index for calls still in progress).
+    """
+    hours = max(1, min(hours, MAX_ANALYTICS_HOURS))
+    since = _hour((datetime.datetime.utcnow() - datetime.timedelta(hours=hours - 1)).strftime("%Y-%m-%d %H:%M:%S"))
+    with reader() as conn:
+        rows = [dict(r) for r in conn.execute("SELECT * FROM call_rollups_hourly WHERE hour >= ? ORDER BY hour", (since,))]
+        active = conn.execute("SELECT count(*) FROM call_stats WHERE ended_at IS NULL AND started_at >= ?", (since,)).fetchone()[0]
+
+    totals = {c: sum(r[c] for r in rows) for c in ROLLUP_COLUMNS}
+    ended = totals["ended_calls"]
+    return {
+        "hours": hours,
+        "totals": {
+            **totals,
+            "active_calls": active,
+            "avg_turns_per_call": round(totals["turns"] / totals["calls"], 2) if totals["calls"] else 0.0,
+            "avg_duration_seconds": round(totals["total_duration_seconds"] / ended, 1) if ended else 0.0,
+            "transfer_rate": round(totals["transfers"] / totals["calls"], 3) if totals["calls"] else 0.0,
+        },
+        "hourly": rows,
+    }
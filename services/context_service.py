@@ -0,0 +1,206 @@
+import os
+import json
+import re
+import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from services.intent_service import INTENTS, normalize
+
+# Relevance-filtered prompt context. HOTEL_INFO is split into sections (each
+# menu, each facility, wifi, amenities, ...); a turn's prompt carries only the
+# sections its utterance and recent history touch, plus the menus open right
+# now. PROMPT_CONTEXT=full restores the whole-file dump.
+PROMPT_CONTEXT = os.getenv("PROMPT_CONTEXT", "relevant")
+# User turns (including the current one) whose topics stay in context
+CONTEXT_HISTORY_TURNS = int(os.getenv("CONTEXT_HISTORY_TURNS", "3"))
+
+MENU_KEY = "room_service_menu"
+# Menus with their own service hours; the others go along with any food order
+TIMED_MENUS = ("breakfast", "all_day_dining", "late_night")
+# Always sent: small and relevant to most requests
+ALWAYS = ("policies",)
+
+FOOD_WORDS = [
+    "food", "eat", "hungry", "menu", "order", "breakfast", "lunch", "dinner", "snack", "room service", "deliver",
+    "comida", "comer", "hambre", "menu", "pedir", "desayuno", "almuerzo", "cena",
+    "nourriture", "manger", "faim", "commander", "petit dejeuner", "dejeuner", "diner",
+]
+SECTION_WORDS = {
+    "amenities": [
+        "amenities", "towel", "towels", "pillow", "pillows", "toothbrush", "toothpaste", "razor", "slippers", "robe",
+        "toallas", "toalla", "almohada", "almohadas", "cepillo", "bata",
+        "serviette", "serviettes", "oreiller", "oreillers", "brosse a dents", "peignoir",
+    ],
+    f"{MENU_KEY}.desserts": ["dessert", "desserts", "sweet", "cake", "postre", "postres", "gateau"],
+    f"{MENU_KEY}.beverages": [
+        "drink", "drinks", "wine", "beer", "coffee", "tea", "water", "soda",
+        "bebida", "vino", "cerveza", "cafe", "agua", "boisson", "vin", "biere", "eau",
+    ],
+}
+# Words in item names too generic to point at one section
+STOP_WORDS = {"with", "house", "fresh", "local", "extra", "side", "selection", "grand", "plate", "style", "choice", "glass"}
+
+_HOURS = re.compile(r"(\d{1,2}):(\d{2})\s*([AP]M)\s*-\s*(\d{1,2}):(\d{2})\s*([AP]M)", re.IGNORECASE)
+
+context_stats = {"turns": 0, "chars": 0, "full_chars": 0}
+
+_index_version: Optional[int] = None
+_keywords: Dict[str, Set[str]] = {}
+
+def _minutes(hour: str, minute: str, meridiem: str) -> int:
+    return (int(hour) % 12 + (12 if meridiem.upper() == "PM" else 0)) * 60 + int(minute)
+
+def is_open(hours: str, now: datetime.datetime) -> bool:
+    """
+    Whether a "6:00 AM - 11:00 AM" style window contains now. Windows that
+    cannot be parsed (e.g. "24/7") count as open.
+    """
+    match = _HOURS.search(hours or "")
+    if not match:
+        return True
+    start, end = _minutes(*match.group(1, 2, 3)), _minutes(*match.group(4, 5, 6))
+    current = now.hour * 60 + now.minute
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end  # overnight, e.g. late night
+
+def sections(hotel_info: Dict) -> Dict[str, object]:
+    """
+    Section name -> content. Menus and facilities are split per entry;
+    other non-scalar top-level keys are one section each.
+    """
+    result = {}
+    for key, value in hotel_info.items():
+        if key in (MENU_KEY, "facilities") and isinstance(value, dict):
+            for child, content in value.items():
+                result[f"{key}.{child}"] = content
+        elif isinstance(value, (dict, list)):
+            result[key] = value
+    return result
+
+def _names(content) -> Iterable[str]:
+    # Item, service and amenity names anywhere in a section
+    if isinstance(content, str):
+        yield content
+    elif isinstance(content, list):
+        for item in content:
+            yield from _names(item.get("name", "") if isinstance(item, dict) else item)
+    elif isinstance(content, dict):
+        for key, value in content.items():
+            if key in ("items", "services", "starters", "mains", "pizza", "sides") or isinstance(value, list):
+                yield from _names(value)
+
+def _build_keywords(hotel_info: Dict) -> Dict[str, Set[str]]:
+    keywords: Dict[str, Set[str]] = {}
+    topic_aliases = {
+        "wifi": INTENTS["wifi"]["topic"],
+        "facilities.pool": INTENTS["pool"]["topic"],
+        "facilities.gym": INTENTS["gym"]["topic"],
+        "facilities.spa": INTENTS["spa"]["topic"],
+    }
+    for name, content in sections(hotel_info).items():
+        words = set(SECTION_WORDS.get(name, []))
+        for aliases in topic_aliases.get(name, {}).values():
+            words.update(aliases)
+        if not words and not name.startswith(f"{MENU_KEY}."):
+            # No curated vocabulary (e.g. a newly added "parking" block): left
+            # out of the index, so it is always sent
+            continue
+        for item in _names(content):
+            text = normalize(item).strip()
+            words.add(text)
+            words.update(w for w in text.split() if len(w) >= 4 and w not in STOP_WORDS)
+        words.discard("")
+        if words:
+            keywords[name] = words
+    return keywords
+
+def _refresh(hotel_info: Dict, version: int):
+    global _index_version, _keywords
+    if version != _index_version:
+        _keywords = _build_keywords(hotel_info)
+        _index_version = version
+
+def select_sections(hotel_info: Dict, utterances: List[str], now: datetime.datetime, version: int = 0) -> Tuple[str, ...]:
+    """
+    The sections a turn needs, sorted (usable as a cache key). Uses the
+    last CONTEXT_HISTORY_TURNS utterances, so a topic raised earlier in the
+    call stays in context for follow-ups.
+    """
+    _refresh(hotel_info, version)
+    available = sections(hotel_info)
+    text = " ".join(normalize(u) for u in utterances[-CONTEXT_HISTORY_TURNS:])
+    selected = {name for name in ALWAYS if name in available}
+
+    for name, words in _keywords.items():
+        if any(f" {word} " in text for word in words):
+            selected.add(name)
+    # Sections nobody taught the index about are always sent
+    selected.update(name for name in available if name not in _keywords)
+
+    menus = [f"{MENU_KEY}.{menu}" for menu in TIMED_MENUS if f"{MENU_KEY}.{menu}" in available]
+    # Any food talk loads whatever menu is being served now
+    food = any(f" {word} " in text for word in FOOD_WORDS)
+    if food or any(name.startswith(f"{MENU_KEY}.") for name in selected):
+        open_menus = {name for name in menus if is_open(available[name].get("hours", ""), now)}
+        # A closed menu is only needed when the item asked for is not on an
+        # open one (e.g. pancakes at night, so the model can decline)
+        if selected.intersection(open_menus):
+            selected.difference_update(set(menus) - open_menus)
+        selected.update(open_menus)
+        # Drinks go with any food order (upselling)
+        if f"{MENU_KEY}.beverages" in available:
+            selected.add(f"{MENU_KEY}.beverages")
+    return tuple(sorted(selected))
+
+def render_context(hotel_info: Dict, selected: Optional[Iterable[str]]) -> Dict:
+    """
+    HOTEL_INFO cut down to the selected sections, keeping its structure.
+    Scalars (name, check-in/out) are always kept, and every timed menu keeps
+    its hours so the model can still say when it opens. None means all.
+    """
+    if selected is None or PROMPT_CONTEXT == "full":
+        return hotel_info
+    selected = set(selected)
+    result = {}
+    for key, value in hotel_info.items():
+        if key in (MENU_KEY, "facilities") and isinstance(value, dict):
+            part = {}
+            for child, content in value.items():
+                if f"{key}.{child}" in selected:
+                    part[child] = content
+                elif key == MENU_KEY and isinstance(content, dict) and "hours" in content:
+                    part[child] = {"hours": content["hours"]}
+            if part:
+                result[key] = part
+        elif not isinstance(value, (dict, list)) or key in selected:
+            result[key] = value
+    return result
+
+_sizes: Dict[Tuple, Tuple[int, int]] = {}  # (version, mode, sections) -> (chars, full chars)
+
+def record(hotel_info: Dict, version: int, selected: Optional[Tuple[str, ...]]):
+    """
+    Counts one LLM turn's hotel info size against the full dump. Sizes are
+    memoized per section set, so this is cheap on every turn.
+    """
+    key = (version, PROMPT_CONTEXT, selected)
+    if key not in _sizes:
+        if len(_sizes) >= 256:
+            _sizes.clear()
+        _sizes[key] = (
+            len(json.dumps(render_context(hotel_info, selected), indent=2)),
+            len(json.dumps(hotel_info, indent=2)),
+        )
+    chars, full_chars = _sizes[key]
+    context_stats["turns"] += 1
+    context_stats["chars"] += chars
+    context_stats["full_chars"] += full_chars
+
+def get_context_stats() -> Dict:
+    turns = context_stats["turns"]
+    return {
+        "mode": PROMPT_CONTEXT,
+        "prompts": turns,
+        "avg_chars": round(context_stats["chars"] / turns) if turns else 0,
+        "avg_full_chars": round(context_stats["full_chars"] / turns) if turns else 0,
+    }
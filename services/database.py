@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = os.getenv("DB_FILE", "hotel.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_MB", "64")) * 1024 * 1024
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "8192"))
+# Per-connection cache of compiled statements, keyed by SQL text
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+# One writer connection behind a lock, one reader connection per thread.
+# WAL lets readers run while the writer commits.
+_local = threading.local()
+_writer: Optional[sqlite3.Connection] = None
+_writer_lock = threading.RLock()
+_readers: List[sqlite3.Connection] = []
+_readers_lock = threading.Lock()
+_generation = 0  # bumped by close_all so threads drop their stale readers
+
+def _connect(readonly: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DB_FILE,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+@contextmanager
+def reader() -> Iterator[sqlite3.Connection]:
+    """
+    Yields this thread's read-only connection. Safe to use from the event
+    loop and from worker threads alike, since each thread gets its own.
+    """
+    conn = getattr(_local, "reader", None)
+    if conn is None or getattr(_local, "generation", None) != _generation:
+        conn = _connect(readonly=True)
+        _local.reader = conn
+        _local.generation = _generation
+        with _readers_lock:
+            _readers.append(conn)
+    yield conn
+
+@contextmanager
+def writer() -> Iterator[sqlite3.Connection]:
+    """
+    Yields the shared writer connection inside a transaction. Commits on
+    success and rolls back on error.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _connect()
+        try:
+            yield _writer
+            _writer.commit()
+        except BaseException:
+            _writer.rollback()
+            raise
+
+def close_all():
+    global _writer, _generation
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+    with _readers_lock:
+        for conn in _readers:
+            conn.close()
+        _readers.clear()
+        _generation += 1
@@ -0,0 +1,66 @@
+import os
+import asyncio
+import logging
+from typing import Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Change notifications for the dashboard. Writers call publish(topic) after
+# committing; each open /api/events stream gets the topic once, however many
+# writes happened while it was busy.
+TOPICS = ("transcripts", "tickets")
+# Streams end after this long and the browser's EventSource reconnects. This
+# also bounds how long a server shutdown waits on open dashboards.
+SSE_MAX_STREAM_SECONDS = float(os.getenv("SSE_MAX_STREAM_SECONDS", "30"))
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_subscribers: Set["Subscription"] = set()
+
+class Subscription:
+    def __init__(self):
+        self.pending: Set[str] = set()
+        self._event = asyncio.Event()
+
+    def _notify(self, topic: str):
+        self.pending.add(topic)
+        self._event.set()
+
+    async def wait(self, timeout: float) -> Set[str]:
+        """
+        Returns the topics changed since the last call, or an empty set after
+        timeout so the caller can send a keep-alive.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+        topics, self.pending = self.pending, set()
+        return topics
+
+def bind_loop():
+    """
+    Called from the startup hook; publish() is a no-op until then.
+    """
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+def subscribe() -> Subscription:
+    sub = Subscription()
+    _subscribers.add(sub)
+    return sub
+
+def unsubscribe(sub: Subscription):
+    _subscribers.discard(sub)
+
+def publish(topic: str):
+    """
+    Thread-safe: writers run in worker threads as well as on the loop.
+    """
+    if _loop is None or _loop.is_closed():
+        return
+    _loop.call_soon_threadsafe(_dispatch, topic)
+
+def _dispatch(topic: str):
+    for sub in list(_subscribers):
+        sub._notify(topic)
@@ -1,62 +1,125 @@
 import json
 import os
-from typing import Dict, Optional
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from services.database import reader, writer
 
-DATA_FILE = "data/guests.json"
+logger = logging.getLogger(__name__)
 
-def load_guests() -> Dict:
-    if not os.path.exists(DATA_FILE):
-        return {}
+# Profiles live in hotel.db (guest_profiles, keyed by phone). The old JSON
+# file is only read once, by the migration that imports it.
+LEGACY_DATA_FILE = "data/guests.json"
+PROFILE_FIELDS = ("name", "visits", "preferences", "last_order")
+
+GUEST_CACHE_SIZE = int(os.getenv("GUEST_CACHE_SIZE", "10000"))
+# Bounds how stale a profile can be when another worker wrote it
+GUEST_CACHE_TTL_SECONDS = float(os.getenv("GUEST_CACHE_TTL_SECONDS", "30"))
+
+_cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _default_profile(phone_number: str) -> Dict:
+    return {
+        "phone": phone_number,
+        "name": None,
+        "visits": 1,
+        "preferences": [],
+        "last_order": None,
+        "version": 0
+    }
+
+def import_legacy_profiles(conn):
+    """
+    Migration step: copies data/guests.json into guest_profiles.
+    """
+    if not os.path.exists(LEGACY_DATA_FILE):
+        return
     try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
+        with open(LEGACY_DATA_FILE, 'r') as f:
+            guests = json.load(f)
     except:
-        return {}
+        logger.error(f"Could not read {LEGACY_DATA_FILE}; skipping profile import")
+        return
+    conn.executemany(
+        "INSERT OR IGNORE INTO guest_profiles (phone, name, visits, preferences, last_order) VALUES (?, ?, ?, ?, ?)",
+        [
+            (phone, p.get("name"), p.get("visits", 0), json.dumps(p.get("preferences", [])), p.get("last_order"))
+            for phone, p in guests.items()
+        ],
+    )
+    logger.info(f"Imported {len(guests)} guest profiles from {LEGACY_DATA_FILE}")
+
+def _load_profile(phone_number: str) -> Dict:
+    with reader() as conn:
+        row = conn.execute("SELECT * FROM guest_profiles WHERE phone = ?", (phone_number,)).fetchone()
+    if row is None:
+        return _default_profile(phone_number)
+    profile = dict(row)
+    profile["preferences"] = json.loads(profile["preferences"] or "[]")
+    return profile
 
-def save_guests(data: Dict):
-    os.makedirs("data", exist_ok=True)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+def _cached_profile(phone_number: str) -> Dict:
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(phone_number)
+        if entry and now - entry[0] < GUEST_CACHE_TTL_SECONDS:
+            _cache.move_to_end(phone_number)
+            return entry[1]
+
+    profile = _load_profile(phone_number)
+    with _cache_lock:
+        _cache[phone_number] = (now, profile)
+        _cache.move_to_end(phone_number)
+        while len(_cache) > GUEST_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return profile
+
+def get_profile_version(phone_number: str) -> int:
+    """
+    Change marker for a guest's profile, used to invalidate cached prompts.
+    Every update bumps it.
+    """
+    return _cached_profile(phone_number)["version"]
 
 def get_guest_profile(phone_number: str) -> Dict:
     """
     Retrieves guest profile or creates a default one.
     """
-    guests = load_guests()
-    if phone_number not in guests:
-        return {
-            "phone": phone_number,
-            "name": None,
-            "visits": 1,
-            "preferences": [],
-            "last_order": None
-        }
-    return guests[phone_number]
+    profile = _cached_profile(phone_number)
+    return {**profile, "preferences": list(profile["preferences"])}
 
 def update_guest_profile(phone_number: str, updates: Dict):
     """
     Updates specific fields in a guest profile.
     """
-    guests = load_guests()
-    if phone_number not in guests:
-        guests[phone_number] = {
-            "phone": phone_number,
-            "name": None,
-            "visits": 0, # Will be incremented
-            "preferences": [],
-            "last_order": None
-        }
-    
-    # Apply updates
-    for key, value in updates.items():
-        guests[phone_number][key] = value
-    
+    unknown = set(updates) - set(PROFILE_FIELDS)
+    if unknown:
+        logger.warning(f"Ignoring unknown guest profile fields: {sorted(unknown)}")
+    fields = {k: v for k, v in updates.items() if k in PROFILE_FIELDS}
+    if "preferences" in fields:
+        fields["preferences"] = json.dumps(fields["preferences"])
+
+    columns = list(fields)
+    assignments = [f"{col} = excluded.{col}" for col in columns]
     # Auto-increment visits if not explicitly set
-    if "visits" not in updates:
-         guests[phone_number]["visits"] += 1
-         
-    save_guests(guests)
+    if "visits" not in fields:
+        columns.append("visits")
+        fields["visits"] = 1
+        assignments.append("visits = guest_profiles.visits + 1")
+    assignments.append("version = guest_profiles.version + 1")
+
+    # Single-row upsert: concurrent updates to one guest can't lose each other
+    with writer() as conn:
+        conn.execute(
+            f"INSERT INTO guest_profiles (phone, {', '.join(columns)}, version) VALUES (?, {', '.join('?' * len(columns))}, 1) "
+            f"ON CONFLICT(phone) DO UPDATE SET {', '.join(assignments)}",
+            [phone_number, *fields.values()],
+        )
+    with _cache_lock:
+        _cache.pop(phone_number, None)
 
 def save_last_order(phone_number: str, order_details: str):
     update_guest_profile(phone_number, {"last_order": order_details})
-
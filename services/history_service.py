@@ -1,35 +1,180 @@
-import sqlite3
-from typing import Optional
+import os
+import time
+import asyncio
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+from services.database import reader, writer
+from services.events_service import publish
+from services import analytics_service
 
-DB_FILE = "hotel.db"
+logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Write-behind: calls and transcript lines are queued in memory and committed
+# in one transaction every WRITE_BEHIND_INTERVAL_MS or WRITE_BEHIND_MAX_ROWS,
+# whichever comes first, so the turn never waits on an fsync. Call analytics
+# are updated from the same batch, in the same transaction.
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50"))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "100"))
+
+_pending_calls: List[Tuple] = []
+_pending_transcripts: List[Tuple] = []
+_pending_events: List[Tuple] = []
+_pending_ends: List[Tuple] = []
+_pending_lock = threading.Lock()
+_flush_event: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_flusher_task: Optional[asyncio.Task] = None
+
+writer_stats = {"flushes": 0, "rows_flushed": 0, "flush_errors": 0, "analytics_errors": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0}
+
+def _now() -> str:
+    # Same format as SQLite's CURRENT_TIMESTAMP, taken when the event happened
+    return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
 def log_call_start(call_sid: str, phone: str):
-    conn = get_db_connection()
-    conn.execute("INSERT OR IGNORE INTO calls (call_sid, guest_phone) VALUES (?, ?)", (call_sid, phone))
-    conn.commit()
-    conn.close()
+    _enqueue(_pending_calls, (call_sid, phone, _now()))
 
 def log_transcript(call_sid: str, role: str, content: str):
-    conn = get_db_connection()
-    conn.execute("INSERT INTO transcripts (call_sid, role, content) VALUES (?, ?, ?)", (call_sid, role, content))
-    conn.commit()
-    conn.close()
+    _enqueue(_pending_transcripts, (call_sid, role, content, _now()))
+
+def log_call_event(call_sid: str, kind: str):
+    """
+    Counts a "ticket" or "transfer" against the call.
+    """
+    _enqueue(_pending_events, (call_sid, kind, _now()))
+
+def log_call_end(call_sid: str, status: str, duration_seconds: Optional[int] = None):
+    """
+    Hangup: finalizes the call's status, duration and summary.
+    """
+    _enqueue(_pending_ends, (call_sid, status, duration_seconds, _now()))
+
+def _depth() -> int:
+    return len(_pending_calls) + len(_pending_transcripts) + len(_pending_events) + len(_pending_ends)
+
+def _enqueue(buffer: List[Tuple], row: Tuple):
+    if _flusher_task is None:
+        # No write-behind loop running (scripts, one-off tools): write through
+        with _pending_lock:
+            buffer.append(row)
+        flush()
+        return
+
+    with _pending_lock:
+        buffer.append(row)
+        depth = _depth()
+    if depth >= WRITE_BEHIND_MAX_ROWS:
+        _loop.call_soon_threadsafe(_flush_event.set)
+
+def flush():
+    """
+    Commits everything queued so far in a single transaction.
+    """
+    with _pending_lock:
+        calls, transcripts = _pending_calls[:], _pending_transcripts[:]
+        events, ends = _pending_events[:], _pending_ends[:]
+        del _pending_calls[:], _pending_transcripts[:], _pending_events[:], _pending_ends[:]
+    rows = len(calls) + len(transcripts) + len(events) + len(ends)
+    if not rows:
+        return
+
+    start = time.perf_counter()
+    try:
+        with writer() as conn:
+            # Calls first so transcript lines never reference a missing call
+            conn.executemany("INSERT OR IGNORE INTO calls (call_sid, guest_phone, start_time) VALUES (?, ?, ?)", calls)
+            conn.executemany("INSERT INTO transcripts (call_sid, role, content, timestamp) VALUES (?, ?, ?, ?)", transcripts)
+            # A bug in the analytics must not hold up the transcripts
+            conn.execute("SAVEPOINT analytics")
+            try:
+                analytics_service.apply(conn, calls, transcripts, events, ends)
+                conn.execute("RELEASE analytics")
+            except Exception as e:
+                conn.execute("ROLLBACK TO analytics")
+                conn.execute("RELEASE analytics")
+                logger.error(f"Analytics update failed for {rows} rows: {e}")
+                writer_stats["analytics_errors"] += 1
+    except Exception as e:
+        logger.error(f"Write-behind flush failed, requeueing {rows} rows: {e}")
+        writer_stats["flush_errors"] += 1
+        with _pending_lock:
+            _pending_calls[:0] = calls
+            _pending_transcripts[:0] = transcripts
+            _pending_events[:0] = events
+            _pending_ends[:0] = ends
+        return
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    writer_stats["flushes"] += 1
+    writer_stats["rows_flushed"] += rows
+    writer_stats["last_flush_ms"] = round(elapsed_ms, 2)
+    writer_stats["max_flush_ms"] = round(max(writer_stats["max_flush_ms"], elapsed_ms), 2)
+    writer_stats["total_flush_ms"] += elapsed_ms
+    publish("transcripts")
+
+def get_writer_stats() -> Dict:
+    with _pending_lock:
+        depth = _depth()
+    flushes = writer_stats["flushes"]
+    return {
+        **writer_stats,
+        "total_flush_ms": round(writer_stats["total_flush_ms"], 2),
+        "avg_flush_ms": round(writer_stats["total_flush_ms"] / flushes, 2) if flushes else 0.0,
+        "queue_depth": depth,
+    }
+
+async def _flusher():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_event.wait(), WRITE_BEHIND_INTERVAL_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        _flush_event.clear()
+        if _depth():
+            await asyncio.to_thread(flush)
+
+async def start_writer():
+    global _flush_event, _loop, _flusher_task
+    if _flusher_task is None:
+        _loop = asyncio.get_running_loop()
+        _flush_event = asyncio.Event()
+        _flusher_task = asyncio.create_task(_flusher())
+
+async def stop_writer():
+    """
+    Stops the flush loop and commits whatever is still queued.
+    """
+    global _flusher_task
+    if _flusher_task is not None:
+        _flusher_task.cancel()
+        try:
+            await _flusher_task
+        except asyncio.CancelledError:
+            pass
+        _flusher_task = None
+    await asyncio.to_thread(flush)
 
 def get_recent_calls(limit: int = 5):
-    conn = get_db_connection()
-    calls = conn.execute("SELECT * FROM calls ORDER BY start_time DESC LIMIT ?", (limit,)).fetchall()
-    results = []
-    for call in calls:
-        c = dict(call)
-        # Fetch transcript lines
-        lines = conn.execute("SELECT role, content FROM transcripts WHERE call_sid = ? ORDER BY timestamp ASC", (c['call_sid'],)).fetchall()
-        c['transcript'] = [dict(line) for line in lines]
-        results.append(c)
-    conn.close()
-    return results
+    with reader() as conn:
+        calls = conn.execute("SELECT * FROM calls ORDER BY start_time DESC LIMIT ?", (limit,)).fetchall()
+        results = []
+        by_sid = {}
+        for call in calls:
+            c = dict(call)
+            c['transcript'] = []
+            by_sid[c['call_sid']] = c
+            results.append(c)
+        if not by_sid:
+            return results
 
+        # One indexed query for every call's transcript lines
+        placeholders = ", ".join("?" * len(by_sid))
+        lines = conn.execute(
+            f"SELECT call_sid, role, content FROM transcripts WHERE call_sid IN ({placeholders}) ORDER BY timestamp ASC, id ASC",
+            list(by_sid),
+        ).fetchall()
+    for line in lines:
+        by_sid[line['call_sid']]['transcript'].append({"role": line['role'], "content": line['content']})
+    return results
@@ -0,0 +1,269 @@
+import os
+import re
+import logging
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Deterministic fast path: common FAQ questions are answered straight from
+# HOTEL_INFO, skipping the LLM round trip. Anything below the threshold, or
+# that looks like a request rather than a question, falls through to Gemini.
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.8"))
+FAST_PATH_MAX_WORDS = 14
+
+# Topic aliases identify what the guest is asking about; question aliases
+# ("when", "password", "open") show it is an information request.
+INTENTS = {
+    "wifi": {
+        "topic": {
+            "en": ["wifi", "wi fi", "internet", "wireless"],
+            "es": ["wifi", "wi fi", "internet", "red inalambrica"],
+            "fr": ["wifi", "wi fi", "internet", "reseau"],
+        },
+        "question": {
+            "en": ["password", "network", "connect", "code", "what is", "whats"],
+            "es": ["contrasena", "clave", "red", "conectar", "cual es"],
+            "fr": ["mot de passe", "code", "connecter", "quel est"],
+        },
+    },
+    "check_out": {
+        "topic": {
+            "en": ["checkout", "check out"],
+            "es": ["salida", "checkout", "check out"],
+            "fr": ["depart", "checkout", "check out"],
+        },
+        "question": {
+            "en": ["when", "what time", "time"],
+            "es": ["cuando", "a que hora", "hora"],
+            "fr": ["quand", "quelle heure", "heure"],
+        },
+    },
+    "check_in": {
+        "topic": {
+            "en": ["checkin", "check in"],
+            "es": ["entrada", "checkin", "check in"],
+            "fr": ["arrivee", "checkin", "check in"],
+        },
+        "question": {
+            "en": ["when", "what time", "time"],
+            "es": ["cuando", "a que hora", "hora"],
+            "fr": ["quand", "quelle heure", "heure"],
+        },
+    },
+    "pool": {
+        "topic": {
+            "en": ["pool", "swimming"],
+            "es": ["piscina", "alberca"],
+            "fr": ["piscine"],
+        },
+        "question": {
+            "en": ["when", "hours", "open", "close", "closes", "where", "what time"],
+            "es": ["cuando", "horario", "abre", "cierra", "donde", "a que hora"],
+            "fr": ["quand", "horaires", "ouvre", "ferme", "ou est", "quelle heure"],
+        },
+    },
+    "gym": {
+        "topic": {
+            "en": ["gym", "fitness", "workout"],
+            "es": ["gimnasio"],
+            "fr": ["salle de sport", "fitness", "gym"],
+        },
+        "question": {
+            "en": ["when", "hours", "open", "close", "closes", "where", "what time"],
+            "es": ["cuando", "horario", "abre", "cierra", "donde", "a que hora"],
+            "fr": ["quand", "horaires", "ouvre", "ferme", "ou est", "quelle heure"],
+        },
+    },
+    "spa": {
+        "topic": {
+            "en": ["spa"],
+            "es": ["spa"],
+            "fr": ["spa"],
+        },
+        "question": {
+            "en": ["when", "hours", "open", "close", "closes", "where", "what time"],
+            "es": ["cuando", "horario", "abre", "cierra", "donde", "a que hora"],
+            "fr": ["quand", "horaires", "ouvre", "ferme", "ou est", "quelle heure"],
+        },
+    },
+    "delivery_time": {
+        "topic": {
+            "en": ["room service", "delivery", "food"],
+        },
+        "question": {
+            "en": ["how long", "how much time", "wait"],
+        },
+    },
+}
+
+# Requests, complaints and orders need the LLM and its tools. The modifiers
+# on the second line of each language turn a question into a request ("I
+# need a late check out, what time is it?").
+ACTION_WORDS = [
+    "book", "order", "reserve", "cancel", "broken", "not working", "doesnt work", "problem", "send", "bring",
+    "manager", "human", "bill", "charge", "complain",
+    "late", "later", "early", "earlier", "extend", "extension", "can i", "could i", "need", "want", "change",
+    "reservar", "pedir", "cancelar", "roto", "no funciona", "problema", "traer", "gerente", "cuenta",
+    "tarde", "temprano", "extender", "puedo", "necesito", "quiero", "cambiar",
+    "reserver", "commander", "annuler", "casse", "ne marche pas", "probleme", "apporter", "directeur", "facture",
+    "tard", "tardif", "tardive", "tot", "prolonger", "puis je", "besoin", "je voudrais", "changer",
+]
+
+ANSWERS = {
+    "wifi": {
+        "en": "The Wi-Fi network is {wifi[network]} and the password is {wifi[password]}.",
+        "es": "La red Wi-Fi es {wifi[network]} y la contraseña es {wifi[password]}.",
+        "fr": "Le réseau Wi-Fi est {wifi[network]} et le mot de passe est {wifi[password]}.",
+    },
+    "check_out": {
+        "en": "Check-out is at {check_out}.",
+        "es": "La hora de salida es a las {check_out}.",
+        "fr": "Le départ est à {check_out}.",
+    },
+    "check_in": {
+        "en": "Check-in is from {check_in}.",
+        "es": "La hora de entrada es a partir de las {check_in}.",
+        "fr": "L'arrivée est à partir de {check_in}.",
+    },
+    "pool": {
+        "en": "The pool is on the {facilities[pool][location]} and is open {facilities[pool][hours]}.",
+        "es": "La piscina está en {facilities[pool][location]} y abre {facilities[pool][hours]}.",
+        "fr": "La piscine se trouve au {facilities[pool][location]} et est ouverte {facilities[pool][hours]}.",
+    },
+    "gym": {
+        "en": "The gym is on the {facilities[gym][location]} and is open {facilities[gym][hours]}.",
+        "es": "El gimnasio está en el {facilities[gym][location]} y abre {facilities[gym][hours]}.",
+        "fr": "La salle de sport se trouve au {facilities[gym][location]} et est ouverte {facilities[gym][hours]}.",
+    },
+    "spa": {
+        "en": "{facilities[spa][name]} is on the {facilities[spa][location]} and is open {facilities[spa][hours]}.",
+        "es": "{facilities[spa][name]} está en el {facilities[spa][location]} y abre {facilities[spa][hours]}.",
+        "fr": "{facilities[spa][name]} se trouve au {facilities[spa][location]} et est ouvert {facilities[spa][hours]}.",
+    },
+    "delivery_time": {
+        # Only English: the policy text itself is English
+        "en": "Room service delivery time: {policies[delivery_time]}",
+    },
+}
+
+fast_path_stats = {"turns": 0, "hits": 0}
+
+_index_version: Optional[int] = None
+_answers: Dict[Tuple[str, str], str] = {}
+
+def normalize(text: str) -> str:
+    """
+    Lowercase, accent-free, punctuation-free, padded with spaces so aliases
+    can be matched on word boundaries with a substring test.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^a-z0-9]+", " ", text.replace("'", ""))
+    return f" {text.strip()} "
+
+def _build_answers(hotel_info: Dict) -> Dict[Tuple[str, str], str]:
+    answers = {}
+    for intent, templates in ANSWERS.items():
+        for lang, template in templates.items():
+            try:
+                answers[(intent, lang)] = template.format(**hotel_info)
+            except (KeyError, TypeError):
+                # Section missing from hotel_info.json: leave it to the LLM
+                continue
+    return answers
+
+def _refresh(hotel_info: Dict, version: int):
+    global _index_version, _answers
+    if version != _index_version:
+        _answers = _build_answers(hotel_info)
+        _index_version = version
+
+def faq_answers(hotel_info: Dict, version: int = 0) -> Dict[Tuple[str, str], str]:
+    """
+    Every fast-path answer by (intent, language); used to pre-render audio.
+    """
+    _refresh(hotel_info, version)
+    return dict(_answers)
+
+def _matches(text: str, aliases: List[str]) -> bool:
+    return any(f" {alias} " in text for alias in aliases)
+
+def score_intents(utterance: str) -> List[Tuple[float, str, str]]:
+    """
+    Returns (confidence, intent, language) for every intent whose topic
+    appears in the utterance, best first.
+    """
+    text = normalize(utterance)
+    words = len(text.split())
+    if words > FAST_PATH_MAX_WORDS or _matches(text, ACTION_WORDS):
+        return []
+
+    scored = []
+    for intent, aliases in INTENTS.items():
+        for lang, topic_aliases in aliases["topic"].items():
+            if not _matches(text, topic_aliases):
+                continue
+            confidence = 0.6
+            if _matches(text, aliases["question"][lang]):
+                confidence += 0.3
+            if words <= 6:
+                confidence += 0.1
+            scored.append((round(confidence, 2), intent, lang))
+    # Prefer the language whose question words matched; ties go to English
+    scored.sort(key=lambda s: (-s[0], s[2] != "en"))
+
+    # Two different topics in one utterance is ambiguous
+    if len({intent for _, intent, _ in scored}) > 1:
+        return [(round(c - 0.3, 2), i, l) for c, i, l in scored]
+    return scored
+
+def _best_answer(utterance: str) -> Optional[Tuple[float, str, str, str]]:
+    scored = score_intents(utterance)
+    if not scored or scored[0][0] < FAST_PATH_THRESHOLD:
+        return None
+    confidence, intent, lang = scored[0]
+    text = _answers.get((intent, lang))
+    if not text:
+        return None
+    return confidence, intent, lang, text
+
+def can_answer(utterance: str, hotel_info: Dict, version: int = 0) -> bool:
+    """
+    Whether match_intent would answer this turn; no stats or logging.
+    """
+    if not FAST_PATH_ENABLED:
+        return False
+    _refresh(hotel_info, version)
+    return _best_answer(utterance) is not None
+
+def match_intent(utterance: str, hotel_info: Dict, version: int = 0) -> Optional[Dict]:
+    """
+    Returns {"intent", "text", "language_code", "confidence"} when the turn
+    can be answered without the LLM, otherwise None.
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+    _refresh(hotel_info, version)
+    fast_path_stats["turns"] += 1
+
+    best = _best_answer(utterance)
+    if best is None:
+        return None
+    confidence, intent, lang, text = best
+
+    fast_path_stats["hits"] += 1
+    logger.info(
+        f"Fast path: {intent}/{lang} confidence={confidence} threshold={FAST_PATH_THRESHOLD} "
+        f"hit_rate={fast_path_stats['hits'] / fast_path_stats['turns']:.2f}"
+    )
+    return {"intent": intent, "text": text, "language_code": lang, "confidence": confidence}
+
+def get_fast_path_stats() -> Dict:
+    turns = fast_path_stats["turns"]
+    return {
+        **fast_path_stats,
+        "hit_rate": round(fast_path_stats["hits"] / turns, 3) if turns else 0.0,
+        "threshold": FAST_PATH_THRESHOLD,
+    }
@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Per-turn latency tracing. Each /handle-speech turn opens a trace tagged with
+# its CallSid; spans inside it (prompt build, LLM, tools, TTS, DB log, TwiML)
+# add to the turn's breakdown and to a rolling per-stage histogram.
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))  # samples kept per stage
+METRICS_RECENT_TURNS = int(os.getenv("METRICS_RECENT_TURNS", "20"))
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "hotel_agent"
+
+class Histogram:
+    """
+    Rolling window of samples for percentiles, plus lifetime count and sum.
+    """
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+
+    def quantiles(self) -> Dict[float, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+class Turn:
+    def __init__(self, call_sid: str):
+        self.call_sid = call_sid
+        self.started_at = time.time()
+        self.total_ms = 0.0
+        self.stages: Dict[str, float] = {}
+        self.tags: Dict[str, str] = {}
+
+    def add(self, stage: str, ms: float):
+        # A stage can run more than once per turn (e.g. two tool calls)
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def to_dict(self) -> Dict:
+        return {
+            "call_sid": self.call_sid,
+            "started_at": self.started_at,
+            "total_ms": round(self.total_ms, 1),
+            "stages": {stage: round(ms, 1) for stage, ms in self.stages.items()},
+            "tags": dict(self.tags),
+        }
+
+_histograms: Dict[str, Histogram] = {}
+_lock = threading.Lock()
+_recent_turns: Deque[Turn] = deque(maxlen=METRICS_RECENT_TURNS)
+# Copied into tasks and to_thread workers, so spans anywhere in a turn find it
+_current_turn: ContextVar[Optional[Turn]] = ContextVar("current_turn", default=None)
+
+def observe(stage: str, seconds: float):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+@contextmanager
+def span(stage: str):
+    """
+    Times the enclosed block as one stage of the current turn.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(stage, elapsed)
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.add(stage, elapsed * 1000)
+
+@contextmanager
+def trace_turn(call_sid: str):
+    """
+    Opens the trace for one conversational turn and logs its breakdown.
+    """
+    turn = Turn(call_sid)
+    token = _current_turn.set(turn)
+    start = time.perf_counter()
+    try:
+        yield turn
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_turn.reset(token)
+        turn.total_ms = elapsed * 1000
+        observe("turn", elapsed)
+        with _lock:
+            _recent_turns.append(turn)
+        breakdown = " ".join(f"{stage}={ms:.0f}ms" for stage, ms in turn.stages.items())
+        logger.info(f"Turn {call_sid}: total={turn.total_ms:.0f}ms {breakdown}")
+
+def tag(key: str, value):
+    """
+    Attaches a label (e.g. which path answered) to the current turn.
+    """
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.tags[key] = str(value)
+
+def get_latency_summary() -> Dict[str, Dict]:
+    """
+    stage -> {count, avg_ms, p50_ms, p95_ms, p99_ms}, with "turn" first.
+    """
+    with _lock:
+        snapshot = {stage: (h.count, h.sum, h.quantiles()) for stage, h in _histograms.items()}
+    summary = {}
+    for stage in sorted(snapshot, key=lambda s: (s != "turn", s)):
+        count, total, quantiles = snapshot[stage]
+        summary[stage] = {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 1) if count else 0.0,
+            **{f"p{int(q * 100)}_ms": round(v * 1000, 1) for q, v in quantiles.items()},
+        }
+    return summary
+
+def get_recent_turns() -> List[Dict]:
+    with _lock:
+        turns = list(_recent_turns)
+    return [turn.to_dict() for turn in reversed(turns)]
+
+def _prometheus_name(*parts: str) -> str:
+    return "_".join(p.replace("-", "_").replace(".", "_") for p in parts if p)
+
+def render_prometheus(gauges: Optional[Dict[str, Dict]] = None) -> str:
+    """
+    Prometheus text exposition: stage latencies as a summary (rolling
+    quantiles, lifetime sum/count) plus numeric service stats as gauges.
+    """
+    name = f"{METRIC_PREFIX}_stage_latency_seconds"
+    lines = [
+        f"# HELP {name} Latency of each turn stage; quantiles over the last {METRICS_WINDOW} samples.",
+        f"# TYPE {name} summary",
+    ]
+    with _lock:
+        snapshot = {stage: (h.count, h.sum, h.quantiles()) for stage, h in _histograms.items()}
+    for stage in sorted(snapshot):
+        count, total, quantiles = snapshot[stage]
+        for q, value in quantiles.items():
+            lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+    for section, stats in (gauges or {}).items():
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            metric = _prometheus_name(METRIC_PREFIX, section, key)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
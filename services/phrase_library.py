@@ -0,0 +1,109 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from typing import Dict, List, Optional
+from services import ai_service
+from services.intent_service import faq_answers
+from services.turn_pipeline import FILLER_TEXT
+from services.admission import HOLD_TEXT, BUSY_TEXT
+from services import tts_service
+from services.tts_service import generate_audio, cache_key, PHRASE_DIR, PHRASE_MANIFEST
+
+logger = logging.getLogger(__name__)
+
+# Phrases the agent says often enough to pre-render. Rendered at build time by
+# prewarm_audio.py (and topped up in the background at startup); the TTS layer
+# serves them from the manifest before trying the cache or ElevenLabs.
+PRERENDER_CONCURRENCY = int(os.getenv("PRERENDER_CONCURRENCY", "4"))
+
+HOTEL_NAME = ai_service.HOTEL_NAME
+
+def get_phrases() -> Dict[str, str]:
+    """
+    The declared library: name -> text. FAQ answers are derived from
+    hotel_info.json so they change with it.
+    """
+    phrases = {
+        # English only: they are played before the caller's language is known
+        "welcome.en": f"Welcome to {HOTEL_NAME}! It is my absolute pleasure to serve you. How may I brighten your stay today?",
+        "didnt_catch.en": "I didn't catch that.",
+        "transfer.en": ai_service.TRANSFER_TEXT,
+        "on_it.en": ai_service.ON_IT_TEXT,
+        "fallback.en": ai_service.FALLBACK_RESPONSE["text"],
+        "tool_busy.en": ai_service.TOOL_BUSY_TEXT,
+        "filler.en": FILLER_TEXT,
+        "hold.en": HOLD_TEXT,
+        "busy.en": BUSY_TEXT,
+    }
+    version = ai_service.refresh_hotel_info()
+    for (intent, lang), text in sorted(faq_answers(ai_service.HOTEL_INFO, version).items()):
+        phrases[f"faq.{intent}.{lang}"] = text
+    return phrases
+
+async def prerender_phrases(names: Optional[List[str]] = None) -> Dict[str, Optional[str]]:
+    """
+    Renders every library phrase that is not already on disk, at most
+    PRERENDER_CONCURRENCY at a time, then rewrites the manifest.
+    Returns name -> path (None for phrases that failed).
+    """
+    os.makedirs(PHRASE_DIR, exist_ok=True)
+    phrases = get_phrases()
+    if names is not None:
+        phrases = {name: text for name, text in phrases.items() if name in names}
+    semaphore = asyncio.Semaphore(PRERENDER_CONCURRENCY)
+    if not tts_service.ELEVENLABS_API_KEY:
+        logger.warning("ELEVENLABS_API_KEY not set; only already-rendered phrases are available")
+
+    async def render(name: str, text: str) -> Optional[str]:
+        # Content-addressed, so an unchanged phrase is never re-rendered
+        path = f"{PHRASE_DIR}/{cache_key(text)}.{tts_service.AUDIO_EXT}"
+        if os.path.exists(path):
+            return path
+        if not tts_service.ELEVENLABS_API_KEY:
+            return None
+        async with semaphore:
+            result = await generate_audio(text, output_filename=path)
+        if not result:
+            logger.error(f"Failed to pre-render phrase '{name}'")
+        return result
+
+    paths = await asyncio.gather(*(render(name, text) for name, text in phrases.items()))
+    results = dict(zip(phrases, paths))
+    _write_manifest({name: {"text": phrases[name], "path": path} for name, path in results.items() if path})
+    return results
+
+def _write_manifest(rendered: Dict[str, Dict]):
+    manifest = {"phrases": {}}
+    if os.path.exists(PHRASE_MANIFEST):
+        try:
+            with open(PHRASE_MANIFEST, "r") as f:
+                manifest = json.load(f)
+        except Exception:
+            pass
+
+    # Keep entries for other phrases still in the library; drop retired ones
+    library = get_phrases()
+    entries = {
+        name: entry for name, entry in manifest.get("phrases", {}).items()
+        if library.get(name) == entry.get("text") and os.path.exists(entry.get("path", ""))
+    }
+    entries.update(rendered)
+
+    # Own temp file: other workers (or prewarm_audio.py) may be writing theirs
+    with tempfile.NamedTemporaryFile("w", dir=PHRASE_DIR, prefix=".manifest.", suffix=".tmp", delete=False) as f:
+        json.dump({"phrases": entries}, f, indent=2, ensure_ascii=False)
+    os.replace(f.name, PHRASE_MANIFEST)
+
+    # Clips no longer referenced by any phrase (including other output
+    # formats). A current phrase's clip is kept even if unreferenced here: a
+    # concurrent prerender may have just written it.
+    referenced = {entry["path"] for entry in entries.values()}
+    referenced.update(f"{PHRASE_DIR}/{cache_key(text)}.{tts_service.AUDIO_EXT}" for text in library.values())
+    for entry in os.scandir(PHRASE_DIR):
+        if entry.name.endswith(tts_service.AUDIO_EXTENSIONS) and f"{PHRASE_DIR}/{entry.name}" not in referenced:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # removed by another worker's cleanup
@@ -0,0 +1,172 @@
+import os
+import random
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+from services import pms_service
+
+logger = logging.getLogger(__name__)
+
+# Async front for the PMS. Tool calls in ai_service go through here so they
+# get a deadline and a concurrency budget whichever backend is behind it.
+PMS_BACKEND = os.getenv("PMS_BACKEND", "sqlite")
+PMS_TIMEOUT_SECONDS = float(os.getenv("PMS_TIMEOUT_SECONDS", "3"))
+PMS_MAX_CONCURRENCY = int(os.getenv("PMS_MAX_CONCURRENCY", "8"))
+
+# Simulated remote PMS
+PMS_SIM_LATENCY_MS = float(os.getenv("PMS_SIM_LATENCY_MS", "250"))
+PMS_SIM_JITTER_MS = float(os.getenv("PMS_SIM_JITTER_MS", "150"))
+PMS_SIM_FAILURE_RATE = float(os.getenv("PMS_SIM_FAILURE_RATE", "0.0"))
+
+adapter_stats = {"calls": 0, "timeouts": 0, "errors": 0}
+
+class PMSError(Exception):
+    """
+    The PMS failed, timed out or is unreachable.
+    """
+
+class PMSBackend(ABC):
+    """
+    Interface every PMS backend implements.
+    """
+    name = "base"
+
+    @abstractmethod
+    async def get_guest(self, phone: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def get_active_booking(self, phone: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def get_folio(self, phone: str) -> Optional[Dict]:
+        """
+        Room number and current balance for the guest's active stay.
+        """
+
+    @abstractmethod
+    async def insert_ticket(self, phone: str, booking_id: int, ticket_type: str, description: str) -> str:
+        """
+        Writes a ticket against a booking the adapter has already looked up.
+        """
+
+class SQLitePMSBackend(PMSBackend):
+    """
+    The local hotel.db, queried from worker threads.
+    """
+    name = "sqlite"
+
+    async def get_guest(self, phone: str) -> Optional[Dict]:
+        return await asyncio.to_thread(pms_service.fetch_guest_details, phone)
+
+    async def get_active_booking(self, phone: str) -> Optional[Dict]:
+        return await asyncio.to_thread(pms_service.fetch_active_booking, phone)
+
+    async def get_folio(self, phone: str) -> Optional[Dict]:
+        booking = await self.get_active_booking(phone)
+        if not booking:
+            return None
+        return {"room_number": booking["room_number"], "balance": booking["balance"], "name": booking.get("name")}
+
+    async def insert_ticket(self, phone: str, booking_id: int, ticket_type: str, description: str) -> str:
+        return await asyncio.to_thread(pms_service.insert_ticket, phone, booking_id, ticket_type, description)
+
+class SimulatedRemotePMSBackend(SQLitePMSBackend):
+    """
+    Same data as SQLite, but every request pays a configurable network-like
+    latency and may fail, to tune the agent against a realistic remote PMS.
+    """
+    name = "simulated"
+
+    def __init__(self, latency_ms: float = PMS_SIM_LATENCY_MS, jitter_ms: float = PMS_SIM_JITTER_MS,
+                 failure_rate: float = PMS_SIM_FAILURE_RATE):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+
+    async def _round_trip(self):
+        delay_ms = max(0.0, random.gauss(self.latency_ms, self.jitter_ms))
+        await asyncio.sleep(delay_ms / 1000)
+        if random.random() < self.failure_rate:
+            raise PMSError("Simulated PMS failure")
+
+    async def get_guest(self, phone: str) -> Optional[Dict]:
+        await self._round_trip()
+        return await super().get_guest(phone)
+
+    async def get_active_booking(self, phone: str) -> Optional[Dict]:
+        await self._round_trip()
+        return await super().get_active_booking(phone)
+
+    async def insert_ticket(self, phone: str, booking_id: int, ticket_type: str, description: str) -> str:
+        await self._round_trip()
+        return await super().insert_ticket(phone, booking_id, ticket_type, description)
+
+_backend: Optional[PMSBackend] = None
+_semaphore = asyncio.Semaphore(PMS_MAX_CONCURRENCY)
+
+def get_backend() -> PMSBackend:
+    global _backend
+    if _backend is None:
+        if PMS_BACKEND == "simulated":
+            _backend = SimulatedRemotePMSBackend()
+        else:
+            if PMS_BACKEND != "sqlite":
+                logger.warning(f"Unknown PMS_BACKEND '{PMS_BACKEND}', using sqlite")
+            _backend = SQLitePMSBackend()
+    return _backend
+
+async def _call(coro):
+    async def bounded():
+        async with _semaphore:
+            return await coro
+
+    adapter_stats["calls"] += 1
+    try:
+        # The deadline covers waiting for a slot as well as the request
+        return await asyncio.wait_for(bounded(), PMS_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        coro.close()
+        adapter_stats["timeouts"] += 1
+        raise PMSError(f"PMS did not answer within {PMS_TIMEOUT_SECONDS}s")
+    except PMSError:
+        adapter_stats["errors"] += 1
+        raise
+    except Exception as e:
+        adapter_stats["errors"] += 1
+        raise PMSError(str(e)) from e
+
+async def _read_through(kind: str, phone: str, fetch) -> Optional[Dict]:
+    # Shares pms_service's per-guest cache, so a hit skips the backend entirely
+    hit, value = pms_service.cache_lookup(kind, phone)
+    if hit:
+        return value
+    value = await _call(fetch(phone))
+    pms_service.cache_store(kind, phone, value)
+    return dict(value) if value else None
+
+# Adapter Public API
+
+async def get_guest(phone: str) -> Optional[Dict]:
+    return await _read_through("guest", phone, get_backend().get_guest)
+
+async def get_active_booking(phone: str) -> Optional[Dict]:
+    return await _read_through("booking", phone, get_backend().get_active_booking)
+
+async def get_folio(phone: str) -> Optional[Dict]:
+    return await _read_through("folio", phone, get_backend().get_folio)
+
+async def create_ticket(phone: str, ticket_type: str, description: str) -> str:
+    # The booking comes through the read-through cache; only the write goes
+    # to the backend
+    booking = await get_active_booking(phone)
+    if not booking:
+        return pms_service.NO_BOOKING_TICKET_TEXT
+    result = await _call(get_backend().insert_ticket(phone, booking["id"], ticket_type, description))
+    pms_service.invalidate_guest(phone)
+    return result
+
+def get_adapter_stats() -> Dict:
+    return {"backend": get_backend().name, **adapter_stats}
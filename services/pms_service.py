@@ -1,146 +1,260 @@
-import sqlite3
+import os
+import time
 import logging
 import datetime
-from typing import Dict, Optional, List
+import threading
+from typing import Dict, Optional, List, Tuple
+from services.database import reader, writer
+from services.events_service import publish
+from services.guest_service import import_legacy_profiles
+from services.analytics_service import backfill_analytics
 
-DB_FILE = "hotel.db"
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Tables whose writes are counted in change_counters (migration 4)
+COUNTED_TABLES = ("tickets", "guests", "calls", "transcripts")
+
+def count_changes(conn):
+    """
+    Migration: per-table write counters kept by triggers, so an insert,
+    update or delete from any process or worker moves them (the dashboard
+    partials' versions).
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS change_counters (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    for table in COUNTED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO change_counters (name) VALUES (?)", (table,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_{op.lower()}_count AFTER {op} ON {table} "
+                f"BEGIN UPDATE change_counters SET version = version + 1 WHERE name = '{table}'; END"
+            )
+
+# Schema changes for databases created by earlier versions. Applied in order;
+# PRAGMA user_version records how many have run.
+MIGRATIONS = [
+    # 1: indexes behind the dashboard queries and per-call transcript lookups
+    [
+        "CREATE INDEX IF NOT EXISTS idx_transcripts_call_sid_timestamp ON transcripts(call_sid, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_calls_start_time ON calls(start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_created_at ON tickets(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_guests_vip_status ON guests(vip_status)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_guest_id_status ON bookings(guest_id, status)",
+    ],
+    # 2: guest profiles move from data/guests.json into guest_profiles
+    [
+        import_legacy_profiles,
+    ],
+    # 3: call_stats and hourly rollups, built from existing calls
+    [
+        backfill_analytics,
+    ],
+    # 4: write counters for the dashboard's render cache
+    [
+        count_changes,
+    ],
+]
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Applying schema migration {number}...")
+        for statement in statements:
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {number}")
 
 def init_db():
     """
     Initialize the database with tables and mock data.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with writer() as conn:
+        cursor = conn.cursor()
     
-    # Guests Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS guests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone TEXT UNIQUE,
-            name TEXT,
-            vip_status TEXT DEFAULT 'Standard'
-        )
-    ''')
+        # Guests Table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS guests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phone TEXT UNIQUE,
+                name TEXT,
+                vip_status TEXT DEFAULT 'Standard'
+            )
+        ''')
     
-    # Bookings Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            guest_id INTEGER,
-            room_number TEXT,
-            check_in DATE,
-            check_out DATE,
-            balance REAL DEFAULT 0.0,
-            status TEXT DEFAULT 'Active',
-            FOREIGN KEY(guest_id) REFERENCES guests(id)
-        )
-    ''')
+        # Bookings Table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bookings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guest_id INTEGER,
+                room_number TEXT,
+                check_in DATE,
+                check_out DATE,
+                balance REAL DEFAULT 0.0,
+                status TEXT DEFAULT 'Active',
+                FOREIGN KEY(guest_id) REFERENCES guests(id)
+            )
+        ''')
     
-    # Tickets Table (Maintenance/Housekeeping)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tickets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            booking_id INTEGER,
-            type TEXT,
-            description TEXT,
-            status TEXT DEFAULT 'Open',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(booking_id) REFERENCES bookings(id)
-        )
-    ''')
-
-    # Calls Table (For History)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS calls (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            call_sid TEXT UNIQUE,
-            guest_phone TEXT,
-            start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            summary TEXT,
-            status TEXT DEFAULT 'in-progress'
-        )
-    ''')
-
-    # Transcripts Table (Line by Line)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transcripts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            call_sid TEXT,
-            role TEXT, -- 'user' or 'assistant'
-            content TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(call_sid) REFERENCES calls(call_sid)
-        )
-    ''')
+        # Tickets Table (Maintenance/Housekeeping)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tickets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                booking_id INTEGER,
+                type TEXT,
+                description TEXT,
+                status TEXT DEFAULT 'Open',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(booking_id) REFERENCES bookings(id)
+            )
+        ''')
+
+        # Guest Profiles (Agent memory: preferences, last order)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS guest_profiles (
+                phone TEXT PRIMARY KEY,
+                name TEXT,
+                visits INTEGER DEFAULT 0,
+                preferences TEXT DEFAULT '[]',
+                last_order TEXT,
+                version INTEGER DEFAULT 0
+            )
+        ''')
+
+        # Calls Table (For History)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                call_sid TEXT UNIQUE,
+                guest_phone TEXT,
+                start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                summary TEXT,
+                status TEXT DEFAULT 'in-progress'
+            )
+        ''')
+
+        # Transcripts Table (Line by Line)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS transcripts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                call_sid TEXT,
+                role TEXT, -- 'user' or 'assistant'
+                content TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(call_sid) REFERENCES calls(call_sid)
+            )
+        ''')
     
-    # Seed Mock Data if empty
-    cursor.execute("SELECT count(*) FROM guests")
-    if cursor.fetchone()[0] == 0:
-        logger.info("Seeding mock data...")
+        # Seed Mock Data if empty
+        cursor.execute("SELECT count(*) FROM guests")
+        if cursor.fetchone()[0] == 0:
+            logger.info("Seeding mock data...")
         
-        cursor.execute("INSERT INTO guests (phone, name, vip_status) VALUES (?, ?, ?)", 
-                       ("+14169006975", "Saeed Ghods", "Platinum"))
-        guest_id_1 = cursor.lastrowid
+            cursor.execute("INSERT INTO guests (phone, name, vip_status) VALUES (?, ?, ?)", 
+                           ("+14169006975", "Saeed Ghods", "Platinum"))
+            guest_id_1 = cursor.lastrowid
         
-        cursor.execute("INSERT INTO bookings (guest_id, room_number, check_in, check_out, balance) VALUES (?, ?, ?, ?, ?)",
-                       (guest_id_1, "402", datetime.date.today(), datetime.date.today() + datetime.timedelta(days=3), 450.00))
+            cursor.execute("INSERT INTO bookings (guest_id, room_number, check_in, check_out, balance) VALUES (?, ?, ?, ?, ?)",
+                           (guest_id_1, "402", datetime.date.today(), datetime.date.today() + datetime.timedelta(days=3), 450.00))
 
-        # Add Nasrin Dalir
-        cursor.execute("INSERT INTO guests (phone, name, vip_status) VALUES (?, ?, ?)", 
-                       ("+16473303549", "Nasrin Dalir", "Gold"))
-        guest_id_2 = cursor.lastrowid
+            # Add Nasrin Dalir
+            cursor.execute("INSERT INTO guests (phone, name, vip_status) VALUES (?, ?, ?)", 
+                           ("+16473303549", "Nasrin Dalir", "Gold"))
+            guest_id_2 = cursor.lastrowid
         
-        cursor.execute("INSERT INTO bookings (guest_id, room_number, check_in, check_out, balance) VALUES (?, ?, ?, ?, ?)",
-                       (guest_id_2, "69", datetime.date.today(), datetime.date.today() + datetime.timedelta(days=2), 280.00))
-                       
-    conn.commit()
-    conn.close()
-
-# PMS Public API
-
-def get_guest_details(phone: str) -> Optional[Dict]:
-    conn = get_db_connection()
-    guest = conn.execute("SELECT * FROM guests WHERE phone = ?", (phone,)).fetchone()
-    conn.close()
+            cursor.execute("INSERT INTO bookings (guest_id, room_number, check_in, check_out, balance) VALUES (?, ?, ?, ?, ?)",
+                           (guest_id_2, "69", datetime.date.today(), datetime.date.today() + datetime.timedelta(days=2), 280.00))
+
+        _migrate(conn)
+
+# Read-through cache for per-guest lookups. A call re-reads the same guest and
+# booking on every turn; writes for that guest invalidate explicitly.
+PMS_CACHE_TTL_SECONDS = float(os.getenv("PMS_CACHE_TTL_SECONDS", "30"))
+PMS_CACHE_MAX_ENTRIES = int(os.getenv("PMS_CACHE_MAX_ENTRIES", "10000"))
+
+_cache: Dict[Tuple[str, str], Tuple[float, Optional[Dict]]] = {}  # (kind, phone) -> (expires_at, value)
+_cache_lock = threading.Lock()
+pms_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def cache_lookup(kind: str, phone: str) -> Tuple[bool, Optional[Dict]]:
+    """
+    Returns (hit, value). Used by the async PMS adapter's read-through
+    lookups.
+    """
+    with _cache_lock:
+        entry = _cache.get((kind, phone))
+        if entry and entry[0] > time.monotonic():
+            pms_cache_stats["hits"] += 1
+            return True, (dict(entry[1]) if entry[1] else None)
+        pms_cache_stats["misses"] += 1
+    return False, None
+
+def cache_store(kind: str, phone: str, value: Optional[Dict]):
+    now = time.monotonic()
+    with _cache_lock:
+        if len(_cache) >= PMS_CACHE_MAX_ENTRIES:
+            for key in [k for k, (expires_at, _) in _cache.items() if expires_at <= now]:
+                del _cache[key]
+            if len(_cache) >= PMS_CACHE_MAX_ENTRIES:
+                _cache.clear()
+        _cache[(kind, phone)] = (now + PMS_CACHE_TTL_SECONDS, value)
+
+def invalidate_guest(phone: str):
+    """
+    Drops every cached lookup for this guest. Call after any write that
+    changes their record, booking or balance.
+    """
+    with _cache_lock:
+        for key in [k for k in _cache if k[1] == phone]:
+            del _cache[key]
+        pms_cache_stats["invalidations"] += 1
+
+def get_pms_cache_stats() -> Dict:
+    lookups = pms_cache_stats["hits"] + pms_cache_stats["misses"]
+    return {
+        **pms_cache_stats,
+        "hit_rate": round(pms_cache_stats["hits"] / lookups, 3) if lookups else 0.0,
+        "entries": len(_cache),
+    }
+
+# Uncached reads, used directly by PMS adapter backends
+
+def fetch_guest_details(phone: str) -> Optional[Dict]:
+    with reader() as conn:
+        guest = conn.execute("SELECT * FROM guests WHERE phone = ?", (phone,)).fetchone()
     if guest:
         return dict(guest)
     return None
 
-def get_active_booking(phone: str) -> Optional[Dict]:
-    conn = get_db_connection()
-    booking = conn.execute('''
-        SELECT b.*, g.name 
-        FROM bookings b 
-        JOIN guests g ON b.guest_id = g.id 
-        WHERE g.phone = ? AND b.status = 'Active'
-    ''', (phone,)).fetchone()
-    conn.close()
+def fetch_active_booking(phone: str) -> Optional[Dict]:
+    with reader() as conn:
+        booking = conn.execute('''
+            SELECT b.*, g.name 
+            FROM bookings b 
+            JOIN guests g ON b.guest_id = g.id 
+            WHERE g.phone = ? AND b.status = 'Active'
+        ''', (phone,)).fetchone()
     if booking:
         return dict(booking)
     return None
 
-def create_ticket(phone: str, ticket_type: str, description: str) -> str:
-    booking = get_active_booking(phone)
-    if not booking:
-        return "No active booking found. Cannot create ticket."
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO tickets (booking_id, type, description) VALUES (?, ?, ?)",
-                   (booking['id'], ticket_type, description))
-    ticket_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+# Writes and formatting; cached reads go through services.pms_adapter
+
+NO_BOOKING_TICKET_TEXT = "No active booking found. Cannot create ticket."
+
+def insert_ticket(phone: str, booking_id: int, ticket_type: str, description: str) -> str:
+    """
+    Writes a ticket for a booking already looked up by the caller.
+    """
+    with writer() as conn:
+        cursor = conn.execute("INSERT INTO tickets (booking_id, type, description) VALUES (?, ?, ?)",
+                              (booking_id, ticket_type, description))
+        ticket_id = cursor.lastrowid
+    invalidate_guest(phone)
+    publish("tickets")
     return f"TKT-{ticket_id}"
 
-def get_bill_details(phone: str) -> str:
-    booking = get_active_booking(phone)
+def format_bill(booking: Optional[Dict]) -> str:
     if not booking:
         return "No active booking found."
     
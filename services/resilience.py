@@ -0,0 +1,245 @@
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from services.metrics_service import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Deadlines, circuit breakers, hedging and in-flight budgets for upstream
+# APIs. A stalled or failing upstream costs a turn at most its deadline; once
+# a breaker opens, turns skip that upstream entirely (TTS falls back to <Say>)
+# until a trial request succeeds. An upstream at its budget rejects further
+# calls instead of queueing them behind the ones it is already slow on.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "20"))
+# A hedge is sent once the first attempt is slower than the recent p95, but
+# never sooner than HEDGE_MIN_SECONDS, and for at most HEDGE_MAX_RATIO of calls.
+HEDGE_MIN_SECONDS = float(os.getenv("HEDGE_MIN_MS", "300")) / 1000
+HEDGE_DEFAULT_SECONDS = float(os.getenv("HEDGE_DEFAULT_MS", "1500")) / 1000
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.2"))
+HEDGE_MIN_SAMPLES = 20
+
+T = TypeVar("T")
+
+class UpstreamError(Exception):
+    """
+    The upstream failed, missed its deadline or its breaker is open.
+    """
+
+class RejectedError(UpstreamError):
+    """
+    Rejected without trying.
+    """
+
+class CircuitOpenError(RejectedError):
+    """
+    Rejected: the breaker is open.
+    """
+
+class UpstreamBusyError(RejectedError):
+    """
+    Rejected: the upstream already has its budget of calls in flight.
+    """
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures; open -> half_open
+    after `reset_seconds`, letting one trial request through; half_open ->
+    closed on success, back to open on failure.
+    """
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            self.trial_in_flight = False
+        if self.state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        """
+        The trial ended without an answer (cancelled): neither outcome is
+        known, so the next call becomes the trial.
+        """
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """
+        Returns True if this failure opened the breaker.
+        """
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+class Upstream:
+    def __init__(self, name: str, deadline_seconds: float, hedge: bool = False, max_in_flight: Optional[int] = None):
+        self.name = name
+        self.deadline_seconds = deadline_seconds
+        self.hedge = hedge
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.breaker = CircuitBreaker()
+        self.latency = Histogram(window=200)
+        self.stats = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "busy": 0, "opened": 0, "hedges": 0, "hedge_wins": 0}
+
+    def saturated(self) -> bool:
+        return self.max_in_flight is not None and self.in_flight >= self.max_in_flight
+
+    def available(self) -> bool:
+        """
+        Whether a request would currently be let through (does not use up a
+        half-open trial).
+        """
+        if self.saturated():
+            return False
+        breaker = self.breaker
+        if breaker.state == "closed":
+            return True
+        if breaker.state == "open":
+            return time.monotonic() - breaker.opened_at >= breaker.reset_seconds
+        return not breaker.trial_in_flight
+
+    def hedge_after(self) -> float:
+        if self.latency.count < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_SECONDS
+        return max(HEDGE_MIN_SECONDS, self.latency.quantiles()[0.95])
+
+    def _record(self, ok: bool, elapsed: float = 0.0):
+        if ok:
+            self.latency.observe(elapsed)
+            self.breaker.record_success()
+            return
+        self.stats["failures"] += 1
+        if self.breaker.record_failure():
+            self.stats["opened"] += 1
+            logger.error(f"Circuit breaker for {self.name} opened after {self.breaker.failures} failures")
+
+    async def call(self, attempt: Callable[[], Awaitable[Optional[T]]], deadline_seconds: Optional[float] = None,
+                   hedge: Optional[bool] = None, queue: Optional[asyncio.Semaphore] = None) -> T:
+        """
+        Runs attempt() under the deadline, hedging it if this upstream is
+        hedged (hedge=False opts a single call out). A None result counts as
+        a failure. Raises UpstreamError.
+
+        With a queue (a local concurrency limit), the slot is taken before
+        the deadline starts: time spent waiting for it is not the upstream's
+        and never counts toward the breaker. Waiting calls still count as in
+        flight.
+        """
+        if self.saturated():
+            self.stats["busy"] += 1
+            raise UpstreamBusyError(f"{self.name} has {self.in_flight} calls in flight")
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"{self.name} circuit open")
+        trial = self.breaker.state == "half_open"
+        self.stats["calls"] += 1
+        deadline = deadline_seconds or self.deadline_seconds
+        self.in_flight += 1
+        try:
+            async with queue or contextlib.nullcontext():
+                start = time.perf_counter()
+                if self.hedge if hedge is None else hedge:
+                    result = await asyncio.wait_for(self._hedged(attempt), deadline)
+                else:
+                    result = await asyncio.wait_for(attempt(), deadline)
+        except asyncio.CancelledError:
+            # The caller gave up (continuation timeout, losing hedge): not the
+            # upstream's fault, but a trial must not stay in flight forever
+            if trial:
+                self.breaker.release_trial()
+            raise
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self._record(False)
+            raise UpstreamError(f"{self.name} missed its {deadline}s deadline")
+        except UpstreamError:
+            self._record(False)
+            raise
+        except Exception as e:
+            self._record(False)
+            raise UpstreamError(f"{self.name} failed: {e}") from e
+        finally:
+            self.in_flight -= 1
+        if result is None:
+            self._record(False)
+            raise UpstreamError(f"{self.name} returned no result")
+        self._record(True, time.perf_counter() - start)
+        return result
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[Optional[T]]]) -> Optional[T]:
+        first = asyncio.ensure_future(attempt())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after())
+            if not done and self.stats["hedges"] < HEDGE_MAX_RATIO * self.stats["calls"]:
+                self.stats["hedges"] += 1
+                tasks.append(asyncio.ensure_future(attempt()))
+
+            # First attempt to succeed wins; a failure waits for the other
+            pending = set(tasks)
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and task.result() is not None:
+                        if task is not first:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    if result is None and not task.cancelled() and task.exception() is not None:
+                        result = task.exception()
+            if isinstance(result, Exception):
+                raise result
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+_upstreams: Dict[str, Upstream] = {}
+
+def register(name: str, deadline_seconds: float, hedge: bool = False, max_in_flight: Optional[int] = None) -> Upstream:
+    upstream = Upstream(name, deadline_seconds, hedge, max_in_flight)
+    _upstreams[name] = upstream
+    return upstream
+
+def get_upstream(name: str) -> Optional[Upstream]:
+    return _upstreams.get(name)
+
+def get_resilience_stats() -> Dict[str, Dict]:
+    return {
+        name: {
+            "state": u.breaker.state,
+            "state_code": CircuitBreaker.STATES[u.breaker.state],
+            "consecutive_failures": u.breaker.failures,
+            "deadline_seconds": u.deadline_seconds,
+            "in_flight": u.in_flight,
+            "max_in_flight": u.max_in_flight,
+            "hedge_after_ms": round(u.hedge_after() * 1000, 1) if u.hedge else None,
+            **u.stats,
+        }
+        for name, u in _upstreams.items()
+    }
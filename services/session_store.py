@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Conversation history per CallSid. "memory" is per-process; "sqlite" is
+# shared by every uvicorn worker on the host.
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_FILE = os.getenv("SESSION_DB_FILE", "sessions.db")
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800"))
+SESSION_MAX_CALLS = int(os.getenv("SESSION_MAX_CALLS", "5000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_MB", "64")) * 1024 * 1024
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "20"))
+
+def trim_history(history: List[Dict], max_turns: int = SESSION_MAX_TURNS) -> List[Dict]:
+    """
+    Keeps the last max_turns guest turns. Cuts only at a guest text message
+    so a function call is never separated from its response.
+    """
+    turn_starts = [
+        i for i, content in enumerate(history)
+        if content.get("role") == "user" and any("text" in part for part in content.get("parts", []))
+    ]
+    if len(turn_starts) <= max_turns:
+        return history
+    return history[turn_starts[-max_turns]:]
+
+class SessionStore(ABC):
+    """
+    Interface for conversation history storage. History is a list of
+    Gemini Content dicts, ready to pass to start_chat().
+    """
+
+    @abstractmethod
+    async def get(self, call_sid: str) -> Optional[List[Dict]]:
+        ...
+
+    @abstractmethod
+    async def set(self, call_sid: str, history: List[Dict]):
+        ...
+
+    @abstractmethod
+    async def delete(self, call_sid: str):
+        ...
+
+    @abstractmethod
+    async def stats(self) -> Dict:
+        """
+        Backend name, session count and approximate bytes held.
+        """
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process store with LRU and idle-TTL eviction and a byte budget.
+    """
+
+    def __init__(self, max_calls: int = SESSION_MAX_CALLS, max_bytes: int = SESSION_MAX_BYTES,
+                 idle_ttl: float = SESSION_IDLE_TTL_SECONDS):
+        self.max_calls = max_calls
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        # call_sid -> (last_access, history, approx_bytes), least recent first
+        self._sessions: "OrderedDict[str, Tuple[float, List[Dict], int]]" = OrderedDict()
+        self._bytes = 0
+        self._evictions = 0
+
+    async def get(self, call_sid: str) -> Optional[List[Dict]]:
+        self._expire()
+        entry = self._sessions.get(call_sid)
+        if entry is None:
+            return None
+        _, history, size = entry
+        self._sessions[call_sid] = (time.monotonic(), history, size)
+        self._sessions.move_to_end(call_sid)
+        return list(history)
+
+    async def set(self, call_sid: str, history: List[Dict]):
+        history = trim_history(history)
+        size = len(json.dumps(history, default=str))
+        self._remove(call_sid)
+        self._sessions[call_sid] = (time.monotonic(), history, size)
+        self._bytes += size
+        self._expire()
+        while len(self._sessions) > self.max_calls or self._bytes > self.max_bytes:
+            self._evict_oldest()
+
+    async def delete(self, call_sid: str):
+        self._remove(call_sid)
+
+    async def stats(self) -> Dict:
+        return {"backend": "memory", "sessions": len(self._sessions), "bytes": self._bytes, "evictions": self._evictions}
+
+    def _remove(self, call_sid: str):
+        entry = self._sessions.pop(call_sid, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict_oldest(self):
+        _, (_, _, size) = self._sessions.popitem(last=False)
+        self._bytes -= size
+        self._evictions += 1
+
+    def _expire(self):
+        # Access order doubles as idle order, so expired calls sit at the front
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            last_access = next(iter(self._sessions.values()))[0]
+            if last_access >= cutoff:
+                break
+            self._evict_oldest()
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Process-shared store in a local SQLite file, so several uvicorn workers
+    can serve turns of the same call.
+    """
+
+    PRUNE_EVERY = 200
+
+    def __init__(self, db_file: str = SESSION_DB_FILE, idle_ttl: float = SESSION_IDLE_TTL_SECONDS):
+        self.db_file = db_file
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                call_sid TEXT PRIMARY KEY,
+                history TEXT,
+                updated_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, call_sid: str) -> Optional[List[Dict]]:
+        row = self._conn().execute(
+            "SELECT history FROM sessions WHERE call_sid = ? AND updated_at >= ?",
+            (call_sid, time.time() - self.idle_ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, call_sid: str, history: List[Dict]):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (call_sid, history, updated_at) VALUES (?, ?, ?)",
+            (call_sid, json.dumps(trim_history(history), default=str), time.time()),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.idle_ttl,))
+        conn.commit()
+
+    def _delete(self, call_sid: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE call_sid = ?", (call_sid,))
+        conn.commit()
+
+    async def get(self, call_sid: str) -> Optional[List[Dict]]:
+        return await asyncio.to_thread(self._get, call_sid)
+
+    async def set(self, call_sid: str, history: List[Dict]):
+        await asyncio.to_thread(self._set, call_sid, history)
+
+    async def delete(self, call_sid: str):
+        await asyncio.to_thread(self._delete, call_sid)
+
+    def _stats(self) -> Dict:
+        count, size = self._conn().execute("SELECT count(*), coalesce(sum(length(history)), 0) FROM sessions").fetchone()
+        return {"backend": "sqlite", "sessions": count, "bytes": size}
+
+    async def stats(self) -> Dict:
+        return await asyncio.to_thread(self._stats)
+
+_store: Optional[SessionStore] = None
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        if SESSION_STORE == "sqlite":
+            _store = SQLiteSessionStore()
+        else:
+            if SESSION_STORE != "memory":
+                logger.warning(f"Unknown SESSION_STORE '{SESSION_STORE}', using memory")
+            _store = MemorySessionStore()
+    return _store
+
+async def get_session_stats() -> Dict:
+    return await get_session_store().stats()
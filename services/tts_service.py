@@ -1,58 +1,524 @@
 import os
 import uuid
+import time
+import json
+import struct
+import hashlib
 import aiohttp # Async HTTP client
 import asyncio
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Tuple
+from services import resilience
+from services.resilience import UpstreamError, RejectedError
 
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
+# Overridable so benchmarks can point at a local stand-in
+ELEVENLABS_API_URL = os.getenv("ELEVENLABS_API_URL", "https://api.elevenlabs.io").rstrip("/")
 # Voice ID: "Sarah" (Soft, Pleasant, 5-Star Service)
-DEFAULT_VOICE_ID = "EXAVITQu4vr4xnSDxMaL" 
+DEFAULT_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
+MODEL_ID = "eleven_turbo_v2_5"
+VOICE_SETTINGS = {
+    "stability": 0.6,
+    "similarity_boost": 0.8,
+    "style": 0.5,
+    "use_speaker_boost": True
+}
+
+# Audio format requested from ElevenLabs. Phone audio is 8 kHz, so richer
+# formats are only more bytes for Twilio to fetch and transcode before the
+# first <Play> starts: mp3_22050_32 is the smallest mp3 on offer, ulaw_8000
+# is the phone network's own encoding (served as WAV, the container <Play>
+# accepts for it).
+DEFAULT_OUTPUT_FORMAT = "mp3_22050_32"
+AUDIO_FORMATS = {  # codec -> (file extension, media type)
+    "mp3": ("mp3", "audio/mpeg"),
+    "ulaw": ("wav", "audio/wav"),
+}
+TTS_OUTPUT_FORMAT = os.getenv("TTS_OUTPUT_FORMAT", DEFAULT_OUTPUT_FORMAT)
+if not (TTS_OUTPUT_FORMAT.startswith("mp3_") or TTS_OUTPUT_FORMAT == "ulaw_8000"):
+    print(f"Unsupported TTS_OUTPUT_FORMAT {TTS_OUTPUT_FORMAT}, using {DEFAULT_OUTPUT_FORMAT}")
+    TTS_OUTPUT_FORMAT = DEFAULT_OUTPUT_FORMAT
+AUDIO_EXT, AUDIO_MEDIA_TYPE = AUDIO_FORMATS[TTS_OUTPUT_FORMAT.split("_")[0]]
+AUDIO_EXTENSIONS = tuple(f".{ext}" for ext, _ in AUDIO_FORMATS.values())
+
+# Content-addressed cache: identical replies reuse the same mp3 instead of
+# paying for another ElevenLabs round trip.
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "static/tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024
+TTS_CACHE_MAX_FILES = int(os.getenv("TTS_CACHE_MAX_FILES", "5000"))
+# Background sweep: clips not played for TTS_CACHE_MAX_AGE_HOURS expire, and
+# part files left behind by interrupted syntheses are removed.
+TTS_CACHE_MAX_AGE_SECONDS = float(os.getenv("TTS_CACHE_MAX_AGE_HOURS", "72")) * 3600
+STATIC_SWEEP_SECONDS = float(os.getenv("STATIC_SWEEP_SECONDS", "600"))
+STALE_PART_SECONDS = 600
+
+# One pooled session for the app's lifetime keeps TLS connections to
+# api.elevenlabs.io alive between turns.
+ELEVENLABS_MAX_CONNECTIONS = int(os.getenv("ELEVENLABS_MAX_CONNECTIONS", "20"))
+ELEVENLABS_KEEPALIVE_SECONDS = float(os.getenv("ELEVENLABS_KEEPALIVE_SECONDS", "60"))
+CHUNK_SIZE = 16 * 1024
+# Whole-clip deadline (first byte, for streams); slow clips are hedged
+TTS_DEADLINE_SECONDS = float(os.getenv("TTS_DEADLINE_SECONDS", "5"))
+# Past this many clips in flight new ones are rejected and fall back to <Say>
+ELEVENLABS_MAX_IN_FLIGHT = int(os.getenv("ELEVENLABS_MAX_IN_FLIGHT", str(2 * ELEVENLABS_MAX_CONNECTIONS)))
+elevenlabs = resilience.register("elevenlabs", TTS_DEADLINE_SECONDS, hedge=True, max_in_flight=ELEVENLABS_MAX_IN_FLIGHT)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+# Streaming playback: /handle-speech hands Twilio a /tts-stream/<id>.<ext> URL
+# and the audio is proxied from ElevenLabs as it is synthesized. Stream ids
+# are held in this process only, so this needs a single uvicorn worker (or
+# sticky routing per CallSid).
+TTS_STREAMING = os.getenv("TTS_STREAMING", "false").lower() == "true"
+STREAM_TTL_SECONDS = 120
+
+_pending_streams: Dict[str, Tuple[float, str]] = {}  # stream_id -> (registered_at, text)
+
+# Pre-rendered phrase library (see services/phrase_library.py). Consulted
+# before the cache; never evicted.
+PHRASE_DIR = os.getenv("PHRASE_DIR", "static/phrases")
+PHRASE_MANIFEST = f"{PHRASE_DIR}/manifest.json"
+
+_phrase_manifest_mtime: Optional[int] = None
+_phrases_by_name: Dict[str, str] = {}
+_phrases_by_text: Dict[str, str] = {}
+
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "phrase_hits": 0}
+_cache_index: Optional["OrderedDict[str, int]"] = None  # path -> size, oldest first
+_inflight: Dict[str, asyncio.Future] = {}
+
+async def start_session() -> aiohttp.ClientSession:
+    """
+    Creates the shared ElevenLabs session. Called from the app's startup hook;
+    scripts get one lazily on first use.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=ELEVENLABS_MAX_CONNECTIONS,
+            limit_per_host=ELEVENLABS_MAX_CONNECTIONS,
+            ttl_dns_cache=300,
+            keepalive_timeout=ELEVENLABS_KEEPALIVE_SECONDS,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            # Deadlines are applied per request; sock_read catches streams that stall midway
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=TTS_DEADLINE_SECONDS),
+        )
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def cache_key(text: str, voice_id: str = DEFAULT_VOICE_ID, model_id: str = MODEL_ID, voice_settings: Dict = VOICE_SETTINGS) -> str:
+    """
+    Stable hash of everything that affects the synthesized audio.
+    """
+    payload = json.dumps({
+        "text": text.strip(),
+        "voice_id": voice_id,
+        "model_id": model_id,
+        "voice_settings": voice_settings,
+        "output_format": TTS_OUTPUT_FORMAT,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _load_cache_index() -> "OrderedDict[str, int]":
+    global _cache_index
+    if _cache_index is None:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        entries = []
+        for entry in os.scandir(TTS_CACHE_DIR):
+            # Clips in a previous output format stay indexed so they age out
+            if entry.is_file() and entry.name.endswith(AUDIO_EXTENSIONS):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.path, st.st_size))
+        entries.sort()
+        _cache_index = OrderedDict((path, size) for _, path, size in entries)
+    return _cache_index
+
+def _touch(path: str):
+    index = _load_cache_index()
+    index.move_to_end(path)
+    try:
+        # mtime doubles as the LRU clock so the order survives restarts
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def _evict():
+    index = _load_cache_index()
+    total = sum(index.values())
+    while index and (total > TTS_CACHE_MAX_BYTES or len(index) > TTS_CACHE_MAX_FILES):
+        path, size = index.popitem(last=False)
+        total -= size
+        cache_stats["evictions"] += 1
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+def sweep_static() -> int:
+    """
+    Expires cached clips idle for longer than TTS_CACHE_MAX_AGE_HOURS (the
+    index is oldest first, so this stops at the first fresh one) and removes
+    stale .tmp/.part files. Returns the number of files removed.
+    """
+    now = time.time()
+    removed = 0
+    index = _load_cache_index()
+    for path in list(index):
+        try:
+            if now - os.stat(path).st_mtime < TTS_CACHE_MAX_AGE_SECONDS:
+                break
+        except OSError:
+            del index[path]
+            continue
+        del index[path]
+        if _remove(path):
+            cache_stats["expired"] += 1
+            removed += 1
+
+    for directory in (TTS_CACHE_DIR, PHRASE_DIR):
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            # In-flight attempts are younger than their deadline
+            if entry.name.endswith((".tmp", ".part")) and now - entry.stat().st_mtime > STALE_PART_SECONDS:
+                removed += _remove(entry.path)
+    _evict()
+    return removed
+
+async def run_sweeper():
+    """
+    Calls sweep_static every STATIC_SWEEP_SECONDS until cancelled.
+    """
+    while True:
+        await asyncio.sleep(STATIC_SWEEP_SECONDS)
+        try:
+            removed = sweep_static()
+            if removed:
+                print(f"Static sweep removed {removed} files")
+        except Exception as e:
+            print(f"Static sweep failed: {e}")
+
+def audio_media_type(path: str) -> str:
+    for ext, media_type in AUDIO_FORMATS.values():
+        if path.endswith(f".{ext}"):
+            return media_type
+    return AUDIO_MEDIA_TYPE
+
+def _wav_header(data_size: int = 0) -> bytes:
+    """
+    Header wrapping raw 8 kHz mono μ-law samples as WAV. data_size 0 means
+    not known yet (a stream): the sizes are set to the maximum, which
+    players read as "until end of file".
+    """
+    size = data_size or 0xFFFFFFFF - 36
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", size + 36, b"WAVE", b"fmt ", 16,
+                       7, 1, 8000, 8000, 1, 8, b"data", size)
+
+def get_cache_stats() -> Dict:
+    index = _load_cache_index()
+    lookups = cache_stats["hits"] + cache_stats["misses"] + cache_stats["phrase_hits"]
+    return {
+        **cache_stats,
+        "hit_rate": round((cache_stats["hits"] + cache_stats["phrase_hits"]) / lookups, 3) if lookups else 0.0,
+        "entries": len(index),
+        "bytes": sum(index.values()),
+        "phrases": len(_phrases_by_name),
+    }
+
+def _load_phrase_manifest():
+    global _phrase_manifest_mtime, _phrases_by_name, _phrases_by_text
+    try:
+        mtime = os.stat(PHRASE_MANIFEST).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime == _phrase_manifest_mtime:
+        return
+    by_name, by_text = {}, {}
+    if mtime is not None:
+        try:
+            with open(PHRASE_MANIFEST, "r") as f:
+                manifest = json.load(f)
+            for name, entry in manifest.get("phrases", {}).items():
+                if os.path.exists(entry["path"]):
+                    by_name[name] = entry["path"]
+                    by_text[entry["text"].strip()] = entry["path"]
+        except Exception as e:
+            print(f"Could not read phrase manifest: {e}")
+    _phrases_by_name, _phrases_by_text = by_name, by_text
+    _phrase_manifest_mtime = mtime
+
+def phrase_path(name: str) -> Optional[str]:
+    """
+    Path of a pre-rendered phrase by library name (e.g. "welcome.en").
+    """
+    _load_phrase_manifest()
+    return _phrases_by_name.get(name)
+
+def lookup_cached_audio(text: str) -> Optional[str]:
+    """
+    Returns the pre-rendered or cached clip for this text, if there is one.
+    """
+    _load_phrase_manifest()
+    phrase = _phrases_by_text.get(text.strip())
+    if phrase:
+        cache_stats["phrase_hits"] += 1
+        return phrase
+
+    path = f"{TTS_CACHE_DIR}/{cache_key(text)}.{AUDIO_EXT}"
+    index = _load_cache_index()
+    if path in index:
+        if os.path.exists(path):
+            cache_stats["hits"] += 1
+            _touch(path)
+            return path
+        del index[path]
+    return None
+
+async def wait_for_audio(text: str) -> Optional[str]:
+    """
+    The clip for this text if it is cached or already being synthesized,
+    waiting for it in the latter case. None if no one has started it.
+    """
+    cached = lookup_cached_audio(text)
+    if cached:
+        return cached
+    future = _inflight.get(cache_key(text))
+    if future is None:
+        return None
+    return await asyncio.shield(future)
+
+def _commit_to_cache(tmp_path: str, text: str) -> str:
+    path = f"{TTS_CACHE_DIR}/{cache_key(text)}.{AUDIO_EXT}"
+    os.replace(tmp_path, path)
+    _load_cache_index()[path] = os.path.getsize(path)
+    _evict()
+    return path
 
 async def generate_audio(text: str, output_filename: str = None) -> str:
     """
     Generates audio from text using ElevenLabs API asynchronously.
     Returns the path to the file.
+
+    Without an explicit output_filename the clip is stored in the
+    content-addressed cache and reused for identical text.
     """
-    if not ELEVENLABS_API_KEY:
-        print("ELEVENLABS_API_KEY not set. Skipping audio generation.")
-        return None
+    if output_filename:
+        return await _synthesize_resilient(text, output_filename)
+
+    cached = lookup_cached_audio(text)
+    if cached:
+        return cached
 
-    if not output_filename:
-        output_filename = f"static/{uuid.uuid4()}.mp3"
-    
-    # Ensure static dir exists
-    os.makedirs("static", exist_ok=True)
+    key = cache_key(text)
+
+    # Same reply being synthesized for another call right now: share it
+    if key in _inflight:
+        cache_stats["hits"] += 1
+        return await asyncio.shield(_inflight[key])
+
+    cache_stats["misses"] += 1
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    tmp_path = f"{TTS_CACHE_DIR}/.{key}.{uuid.uuid4().hex}.tmp"
+    result = None
+    try:
+        if await _synthesize_resilient(text, tmp_path):
+            result = _commit_to_cache(tmp_path, text)
+        return result
+    finally:
+        del _inflight[key]
+        # Waiters fall back to <Say> if this synthesis failed or was cancelled
+        future.set_result(result)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _tts_request(text: str, stream: bool = False):
+    url = f"{ELEVENLABS_API_URL}/v1/text-to-speech/{DEFAULT_VOICE_ID}"
+    if stream:
+        url += "/stream"
+    url += f"?output_format={TTS_OUTPUT_FORMAT}"
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{DEFAULT_VOICE_ID}"
-    
     headers = {
-        "Accept": "audio/mpeg",
+        "Accept": AUDIO_MEDIA_TYPE,
         "Content-Type": "application/json",
         "xi-api-key": ELEVENLABS_API_KEY
     }
-    
+
     data = {
         "text": text,
-        "model_id": "eleven_turbo_v2_5",
-        "voice_settings": {
-            "stability": 0.6,
-            "similarity_boost": 0.8,
-            "style": 0.5,
-            "use_speaker_boost": True
-        }
+        "model_id": MODEL_ID,
+        "voice_settings": VOICE_SETTINGS
     }
+    return url, headers, data
+
+async def _synthesize_resilient(text: str, output_filename: str) -> Optional[str]:
+    """
+    _synthesize under the ElevenLabs deadline and circuit breaker. Attempts
+    (the original and any hedge) each write their own part file; the
+    winner is moved to output_filename.
+    """
+    if not ELEVENLABS_API_KEY:
+        print("ELEVENLABS_API_KEY not set. Skipping audio generation.")
+        return None
+
+    parts = []
+
+    async def attempt():
+        part = f"{output_filename}.{uuid.uuid4().hex[:8]}.part"
+        parts.append(part)
+        return await _synthesize(text, part)
+
+    try:
+        winner = await elevenlabs.call(attempt)
+        os.replace(winner, output_filename)
+        return output_filename
+    except RejectedError:
+        return None
+    except UpstreamError as e:
+        print(f"ElevenLabs unavailable: {e}")
+        return None
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+async def _synthesize(text: str, output_filename: str) -> Optional[str]:
+    if not ELEVENLABS_API_KEY:
+        print("ELEVENLABS_API_KEY not set. Skipping audio generation.")
+        return None
+
+    # Ensure output dir exists
+    os.makedirs(os.path.dirname(output_filename) or "static", exist_ok=True)
+
+    url, headers, data = _tts_request(text)
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data, headers=headers) as response:
-                if response.status == 200:
-                    content = await response.read()
-                    with open(output_filename, 'wb') as f:
-                        f.write(content)
-                    return output_filename
-                else:
-                    error_text = await response.text()
-                    print(f"ElevenLabs Error: {error_text}")
-                    return None
+        session = await start_session()
+        async with session.post(url, json=data, headers=headers) as response:
+            if response.status == 200:
+                # Stream to disk as chunks arrive; file I/O stays off the loop
+                f = await asyncio.to_thread(open, output_filename, 'wb')
+                try:
+                    wav = AUDIO_EXT == "wav"
+                    if wav:
+                        await asyncio.to_thread(f.write, _wav_header())
+                    size = 0
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await asyncio.to_thread(f.write, chunk)
+                        size += len(chunk)
+                    if wav:
+                        await asyncio.to_thread(_rewrite_header, f, size)
+                finally:
+                    await asyncio.to_thread(f.close)
+                return output_filename
+            else:
+                error_text = await response.text()
+                print(f"ElevenLabs Error: {error_text}")
+                return None
     except Exception as e:
         print(f"Error calling ElevenLabs: {e}")
         return None
+
+# --- STREAMING PLAYBACK ---
+
+def streaming_enabled() -> bool:
+    # An open breaker means <Say> now, not a stream URL that will fail later
+    return TTS_STREAMING and bool(ELEVENLABS_API_KEY) and elevenlabs.available()
+
+def register_stream(call_sid: str, text: str) -> str:
+    """
+    Registers a reply for streaming and returns the stream id for this turn.
+    """
+    now = time.monotonic()
+    for stream_id, (registered_at, _) in list(_pending_streams.items()):
+        if now - registered_at > STREAM_TTL_SECONDS:
+            del _pending_streams[stream_id]
+
+    stream_id = f"{call_sid}-{uuid.uuid4().hex[:12]}"
+    _pending_streams[stream_id] = (now, text)
+    return stream_id
+
+def get_stream_text(stream_id: str) -> Optional[str]:
+    # Kept until the TTL so a Twilio re-fetch of the same URL still works
+    entry = _pending_streams.get(stream_id)
+    return entry[1] if entry else None
+
+async def open_audio_stream(text: str) -> Optional[AsyncIterator[bytes]]:
+    """
+    Starts a streaming synthesis. Returns None if ElevenLabs refused the
+    request, so the caller can fall back to generate_audio.
+    """
+    if not ELEVENLABS_API_KEY:
+        return None
+
+    url, headers, data = _tts_request(text, stream=True)
+
+    async def attempt() -> Optional[aiohttp.ClientResponse]:
+        session = await start_session()
+        response = await session.post(url, json=data, headers=headers)
+        if response.status != 200:
+            error_text = await response.text()
+            print(f"ElevenLabs Stream Error: {error_text}")
+            response.release()
+            return None
+        return response
+
+    try:
+        # Deadline covers time to first byte; streams are not hedged
+        response = await elevenlabs.call(attempt, hedge=False)
+    except UpstreamError as e:
+        print(f"Error opening ElevenLabs stream: {e}")
+        return None
+
+    cache_stats["misses"] += 1
+    return _relay_stream(text, response)
+
+def _rewrite_header(f, data_size: int):
+    f.seek(0)
+    f.write(_wav_header(data_size))
+
+async def _relay_stream(text: str, response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+    """
+    Yields audio chunks as they arrive and tees them into the cache, so the
+    next identical reply is served from disk.
+    """
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{TTS_CACHE_DIR}/.{cache_key(text)}.{uuid.uuid4().hex}.tmp"
+    f = await asyncio.to_thread(open, tmp_path, 'wb')
+    complete = False
+    try:
+        wav = AUDIO_EXT == "wav"
+        if wav:
+            # Length unknown until the stream ends; fixed up in the cached copy
+            header = _wav_header()
+            yield header
+            await asyncio.to_thread(f.write, header)
+        size = 0
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            yield chunk
+            await asyncio.to_thread(f.write, chunk)
+            size += len(chunk)
+        if wav:
+            await asyncio.to_thread(_rewrite_header, f, size)
+        complete = True
+    finally:
+        response.release()
+        f.close()
+        if complete:
+            _commit_to_cache(tmp_path, text)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,157 @@
+import os
+import re
+import time
+import uuid
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from services.ai_service import get_ai_response
+from services.tts_service import generate_audio, lookup_cached_audio, streaming_enabled
+from services.metrics_service import span
+
+logger = logging.getLogger(__name__)
+
+# Pipelined turns: the reply is produced in a background task. If it is not
+# ready within FILLER_AFTER_SECONDS, /handle-speech answers with a filler
+# clip and a redirect to /continue-speech, which collects the result. Replies
+# are voiced as two segments, the first sentence and the rest, synthesized in
+# parallel so the guest hears the opening sentence sooner. With LLM_STREAMING
+# the segments are the reply's sentences, each sent to TTS as soon as the
+# model has finished writing it.
+#
+# Pending turns live in this process's memory, so the continuation must reach
+# the worker that started the turn: enable only with a single uvicorn worker
+# (or sticky routing per CallSid).
+TURN_PIPELINE = os.getenv("TURN_PIPELINE", "false").lower() == "true"
+FILLER_AFTER_SECONDS = float(os.getenv("FILLER_AFTER_SECONDS", "1.5"))
+# Bounded by Twilio's 15 second webhook timeout
+CONTINUE_WAIT_SECONDS = float(os.getenv("CONTINUE_WAIT_SECONDS", "10"))
+PENDING_TURN_TTL_SECONDS = 120
+# Shorter openings are merged with the next sentence; a tiny clip isn't worth a request
+MIN_FIRST_SEGMENT_CHARS = 20
+
+FILLER_TEXT = "One moment while I check that."
+
+_pending_turns: Dict[str, Tuple[float, asyncio.Task]] = {}  # turn_id -> (started_at, task)
+# Segment syntheses nobody awaits; held so they are not garbage collected
+_prefetches = set()
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def split_segments(text: str) -> List[str]:
+    """
+    [first sentence, rest of the reply], or [text] if it is one sentence.
+    """
+    sentences = _SENTENCE_END.split(text.strip())
+    first = ""
+    while sentences and len(first) < MIN_FIRST_SEGMENT_CHARS:
+        first = f"{first} {sentences.pop(0)}".strip()
+    rest = " ".join(sentences)
+    return [first, rest] if rest else [first]
+
+def _same_text(text: str, sentences: List[str]) -> bool:
+    return " ".join(text.split()) == " ".join(" ".join(sentences).split())
+
+def _prefetch(text: str):
+    task = asyncio.create_task(generate_audio(text))
+    _prefetches.add(task)
+    task.add_done_callback(_prefetches.discard)
+
+async def _voice_segments(segments: List[str]) -> List[Dict]:
+    """
+    Resolves each segment to {"text", "path", "stream"}: a clip path, a
+    segment to fetch from /tts-stream, or neither (spoken with <Say>).
+    Stream URLs are only used with TTS_STREAMING; otherwise all segments are
+    synthesized in parallel and waited for.
+    """
+    voiced = [{"text": text, "path": lookup_cached_audio(text), "stream": False} for text in segments]
+    if streaming_enabled():
+        for segment in voiced:
+            segment["stream"] = not segment["path"]
+        return voiced
+
+    missing = [segment for segment in voiced if not segment["path"]]
+    # Sentences prefetched while the reply streamed are joined, not repeated
+    paths = await asyncio.gather(*(generate_audio(segment["text"]) for segment in missing))
+    for segment, path in zip(missing, paths):
+        segment["path"] = path
+    return voiced
+
+async def run_turn(call_sid: str, user_input: str, caller_number: str) -> Dict:
+    """
+    get_ai_response plus audio: the result gains "segments" (see
+    _voice_segments).
+    """
+    streamed: List[str] = []
+
+    def on_sentence(sentence: str):
+        streamed.append(sentence)
+        if not streaming_enabled():
+            # Synthesis overlaps the rest of the generation
+            _prefetch(sentence)
+
+    ai_result = await get_ai_response(call_sid, user_input, caller_number, on_sentence=on_sentence)
+    text = ai_result["text"]
+    with span("tts"):
+        # A whole reply already on disk (phrase or cache) is played as is
+        cached = lookup_cached_audio(text)
+        if cached:
+            ai_result["segments"] = [{"text": text, "path": cached, "stream": False}]
+        elif streamed and _same_text(text, streamed):
+            # In-flight syntheses are joined rather than repeated
+            ai_result["segments"] = await _voice_segments(streamed)
+        else:
+            # Nothing streamed, or a tool result replaced the streamed text
+            ai_result["segments"] = await _voice_segments(split_segments(text) if TURN_PIPELINE else [text])
+    return ai_result
+
+def _sweep():
+    now = time.monotonic()
+    for turn_id, (started_at, task) in list(_pending_turns.items()):
+        if now - started_at > PENDING_TURN_TTL_SECONDS:
+            del _pending_turns[turn_id]
+            task.cancel()
+
+async def start_turn(call_sid: str, user_input: str, caller_number: str,
+                     on_done: Optional[Callable[[], None]] = None) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Runs the turn for up to FILLER_AFTER_SECONDS. Returns (result, None) if
+    it finished, otherwise (None, turn_id) for /continue-speech to collect.
+    on_done is called when the turn's work ends, even if that is after this
+    returns.
+    """
+    task = asyncio.create_task(run_turn(call_sid, user_input, caller_number))
+    if on_done is not None:
+        task.add_done_callback(lambda _: on_done())
+    if not TURN_PIPELINE:
+        return await task, None
+
+    done, _ = await asyncio.wait({task}, timeout=FILLER_AFTER_SECONDS)
+    if done:
+        return task.result(), None
+
+    _sweep()
+    turn_id = f"{call_sid}-{uuid.uuid4().hex[:12]}"
+    _pending_turns[turn_id] = (time.monotonic(), task)
+    logger.info(f"Turn {turn_id} still running after {FILLER_AFTER_SECONDS}s; playing filler")
+    return None, turn_id
+
+async def collect_turn(turn_id: str) -> Optional[Dict]:
+    """
+    Waits up to CONTINUE_WAIT_SECONDS for a turn handed off by start_turn.
+    None if the turn is unknown (e.g. started by another worker), failed or
+    is still not done; a turn that misses the wait is cancelled, so a reply
+    the guest never hears is not written to the history or transcript.
+    """
+    entry = _pending_turns.pop(turn_id, None)
+    if entry is None:
+        logger.error(f"Turn {turn_id} unknown to this worker")
+        return None
+    task = entry[1]
+    try:
+        return await asyncio.wait_for(task, CONTINUE_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.error(f"Turn {turn_id} not ready after continuation wait; cancelled, reply not delivered")
+    except Exception as e:
+        logger.error(f"Turn {turn_id} failed: {e}")
+    return None
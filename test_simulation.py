@@ -1,10 +1,15 @@
+import os
+import sys
 import requests
 
-URL = "https://hotel-agent-uwpc.onrender.com/handle-speech"
+# Usage: python test_simulation.py [base_url]   (defaults to the Render deploy)
+BASE_URL = (sys.argv[1] if len(sys.argv) > 1 else os.getenv("SIMULATION_URL", "https://hotel-agent-uwpc.onrender.com")).rstrip("/")
+URL = f"{BASE_URL}/handle-speech"
 
 # Simulate Twilio sending user speech
 payload = {
     "CallSid": "TEST_SIMULATION_123",
+    "From": "+15550199",
     "SpeechResult": "Can I order a cheeseburger?"
 }
 
@@ -16,4 +21,3 @@ try:
     print(response.text)
 except Exception as e:
     print(f"Error: {e}")
-